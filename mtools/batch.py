@@ -0,0 +1,260 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from mtools.metrics import JOBS_FINISHED, JOBS_QUEUED, JOBS_RUNNING
+
+LOGGER = logging.getLogger(__name__)
+
+NETWORK_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "fuse.sshfs",
+    "fuse.rclone",
+}
+# default concurrent I/O jobs per device
+ROTATIONAL_CONCURRENCY = 1
+NETWORK_CONCURRENCY = 4
+SOLID_STATE_CONCURRENCY = 8
+UNKNOWN_CONCURRENCY = 4
+# for map_bounded: items in flight per worker, enough to keep workers busy between results
+PENDING_PER_WORKER = 4
+# for map_bounded_per_device: items in flight across all devices
+MAX_PENDING_IO = 64
+
+
+@dataclass
+class Job:
+    name: str
+    # CPU-bound stage, run on the shared worker pool
+    func: Callable[[], Any] | None = None
+    weight: float = 0
+    # I/O-bound stage, run on io_path's device pool; given func's result if there is a CPU stage
+    io_func: Callable[[Any], Any] | None = None
+    io_path: Path | None = None
+
+
+class BatchFailed(Exception): ...
+
+
+def _track_stage(stage: str, func: Callable) -> Callable:
+    """
+    wraps a job stage to keep the queued/running gauges up to date; counts it as queued straight
+    away
+    """
+    JOBS_QUEUED.inc(stage=stage)
+
+    def run(*args):
+        JOBS_QUEUED.dec(stage=stage)
+        JOBS_RUNNING.inc(stage=stage)
+        try:
+            return func(*args)
+        finally:
+            JOBS_RUNNING.dec(stage=stage)
+
+    return run
+
+
+def get_device_id(path: Path) -> int:
+    # the output of a job may not exist yet, so use the nearest existing ancestor
+    for candidate in (path, *path.parents):
+        try:
+            return os.stat(candidate).st_dev
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(path)
+
+
+def _get_filesystem_type(device_id: int) -> str | None:
+    device = f"{os.major(device_id)}:{os.minor(device_id)}"
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8") as mountinfo:
+            for line in mountinfo:
+                fields = line.split()
+                if fields[2] == device:
+                    return fields[fields.index("-") + 1]
+    except OSError:
+        pass
+    return None
+
+
+def _is_rotational(device_id: int) -> bool | None:
+    block_device = Path(f"/sys/dev/block/{os.major(device_id)}:{os.minor(device_id)}")
+    # partitions don't have a queue of their own; their parent disk does
+    for queue_dir in (block_device / "queue", block_device / ".." / "queue"):
+        try:
+            return (queue_dir / "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def detect_device_concurrency(device_id: int) -> int:
+    if _get_filesystem_type(device_id) in NETWORK_FILESYSTEMS:
+        return NETWORK_CONCURRENCY
+    match _is_rotational(device_id):
+        case True:
+            return ROTATIONAL_CONCURRENCY
+        case False:
+            return SOLID_STATE_CONCURRENCY
+        case _:
+            return UNKNOWN_CONCURRENCY
+
+
+class DeviceExecutors:
+    """
+    one thread pool per device (by st_dev), so a slow disk can't take slots from the others
+    """
+
+    def __init__(self, concurrency_per_device: int | None = None):
+        self._concurrency_per_device = concurrency_per_device
+        self._executors: dict[int, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    def get_executor(self, path: Path) -> ThreadPoolExecutor:
+        device_id = get_device_id(path)
+        with self._lock:
+            if device_id not in self._executors:
+                concurrency = self._concurrency_per_device or detect_device_concurrency(
+                    device_id
+                )
+                LOGGER.info(
+                    f"Using {concurrency} I/O slot(s) for device "
+                    f"{os.major(device_id)}:{os.minor(device_id)} ('{path}')"
+                )
+                self._executors[device_id] = ThreadPoolExecutor(max_workers=concurrency)
+            return self._executors[device_id]
+
+    def submit(self, path: Path, func: Callable, *args) -> Future:
+        return self.get_executor(path).submit(func, *args)
+
+    def shutdown(self):
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown()
+
+
+def _map_bounded(
+    submit: Callable[[Any], Future],
+    items: Iterable,
+    max_pending: int,
+) -> Iterator[Any]:
+    pending: deque[Future] = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(submit(item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_bounded(
+    executor: Executor,
+    func: Callable,
+    items: Iterable,
+    max_pending: int,
+) -> Iterator[Any]:
+    """
+    like executor.map, but only takes items from the iterable as results are consumed, keeping at
+    most max_pending in flight; so a lazy producer (e.g. a directory walk) never gets far ahead
+    """
+    yield from _map_bounded(partial(executor.submit, func), items, max_pending)
+
+
+def map_bounded_per_device(
+    func: Callable,
+    items: Iterable,
+    get_path: Callable[[Any], Path],
+    max_pending: int = MAX_PENDING_IO,
+    concurrency_per_device: int | None = None,
+) -> Iterator[Any]:
+    """
+    like map_bounded, but runs each item on the I/O pool of the device its path (get_path(item)) is
+    on, e.g. for tag writes across disks of different speeds
+    """
+    device_executors = DeviceExecutors(concurrency_per_device)
+    try:
+        yield from _map_bounded(
+            lambda item: device_executors.submit(get_path(item), func, item),
+            items,
+            max_pending,
+        )
+    finally:
+        device_executors.shutdown()
+
+
+def run_jobs(
+    jobs: list[Job],
+    max_workers: int | None = None,
+    io_concurrency_per_device: int | None = None,
+) -> list[Any]:
+    """
+    runs jobs' CPU stages on a shared pool, heaviest first so long jobs don't end up running alone
+    at the end, and their I/O stages on per-device pools
+    """
+    jobs = sorted(jobs, key=lambda job: job.weight, reverse=True)
+    results = []
+    failed: list[Job] = []
+    device_executors = DeviceExecutors(io_concurrency_per_device)
+    io_futures: dict[Future, Job] = {}
+
+    def submit_io_stage(job: Job, *value: Any):
+        if job.io_func is None:
+            results.extend(value)
+            JOBS_FINISHED.inc(outcome="done")
+            return
+        io_futures[
+            device_executors.submit(
+                job.io_path, _track_stage("io", job.io_func), *value
+            )
+        ] = job
+
+    def collect(future: Future, job: Job):
+        try:
+            return future.result(), True
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception(f"Job {job.name!r} failed")
+            failed.append(job)
+            JOBS_FINISHED.inc(outcome="failed")
+            return None, False
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            cpu_futures = {
+                executor.submit(_track_stage("cpu", job.func)): job
+                for job in jobs
+                if job.func is not None
+            }
+            for job in jobs:
+                if job.func is None:
+                    submit_io_stage(job)
+            for future in as_completed(cpu_futures):
+                job = cpu_futures[future]
+                value, ok = collect(future, job)
+                if ok:
+                    submit_io_stage(job, value)
+        for future in as_completed(io_futures):
+            value, ok = collect(future, io_futures[future])
+            if ok:
+                results.append(value)
+                JOBS_FINISHED.inc(outcome="done")
+    finally:
+        device_executors.shutdown()
+
+    if failed:
+        raise BatchFailed(f"{len(failed)}/{len(jobs)} job(s) failed")
+    return results
@@ -0,0 +1,60 @@
+import importlib
+import os
+import sys
+from argparse import REMAINDER, ArgumentParser
+from pathlib import Path
+
+from utils_python import setup_logger
+
+from mtools.client import SOCKET_ENV_VAR, run_remote
+
+# subcommand -> module; modules are only imported once their subcommand is chosen
+COMMANDS = {
+    "convert": "mtools.convert_to_m4a",
+    "dedupe": "mtools.dedupe",
+    "metacopy": "mtools.metacopy",
+    "metadel": "mtools.metadel",
+    "metaexport": "mtools.metaexport",
+    "metaimport": "mtools.metaimport",
+    "metamigrate": "mtools.metamigrate",
+    "metaview": "mtools.metaview",
+    "serve": "mtools.server",
+}
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = ArgumentParser(prog="mtools")
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        type=Path,
+        default=os.environ.get(SOCKET_ENV_VAR),
+        help=(
+            "forward the command to a running `mtools serve` on this socket "
+            f"(default: ${SOCKET_ENV_VAR})"
+        ),
+    )
+    parser.add_argument(
+        "command",
+        choices=COMMANDS,
+    )
+    parser.add_argument(
+        "command_args",
+        nargs=REMAINDER,
+    )
+    args = parser.parse_args(argv)
+
+    if args.socket_path and args.command != "serve":
+        sys.exit(run_remote(args.socket_path, args.command, args.command_args))
+
+    module = importlib.import_module(COMMANDS[args.command])
+    # so that subcommand usage/error messages read "mtools <command>"
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    command_args = module.get_args(args.command_args)
+
+    setup_logger()
+    module.main(command_args)
+
+
+if __name__ == "__main__":
+    main()
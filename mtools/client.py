@@ -0,0 +1,34 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+SOCKET_ENV_VAR = "MTOOLS_SOCKET"
+
+
+def get_default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return Path(runtime_dir) / "mtools.sock"
+
+
+def run_remote(socket_path: Path, command: str, argv: list[str]) -> int:
+    """
+    forwards a command to a running `mtools serve`, streaming its output to stdout; returns its exit
+    code
+    """
+    request = {"command": command, "argv": argv, "cwd": os.getcwd()}
+    exit_code = 1
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("r", encoding="utf-8") as responses:
+            for line in responses:
+                response = json.loads(line)
+                if "output" in response:
+                    sys.stdout.write(response["output"])
+                    sys.stdout.flush()
+                if "exit_code" in response:
+                    exit_code = response["exit_code"]
+    return exit_code
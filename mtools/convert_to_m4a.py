@@ -1,45 +1,92 @@
-from argparse import ArgumentError, ArgumentParser, Namespace
+import logging
+import os
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 
-import ffmpeg
 from utils_python import copy_filedate, setup_logger
 
+from mtools.batch import Job, run_jobs
+from mtools.errors import SegmentMismatch
+from mtools.loudness import (
+    Loudness,
+    measure_loudness,
+    parse_ebur128_summary,
+    write_album_gains,
+    write_replaygain_tags,
+)
+from mtools.matcher import DEFAULT_MATCH_THRESHOLD, MatchFeatures, infer_sources
 from mtools.metacopy import copy_metadata
-from mtools.utils import ensure_file, get_prefix_file_paths
+from mtools.metrics import (
+    BYTES_READ,
+    BYTES_WRITTEN,
+    ENCODE_SPEED,
+    PHASE_SECONDS,
+    MetricsExporter,
+    add_metrics_args,
+)
+from mtools.preflight import ProbeCache, ProbeResult, preflight, print_preflight_report
+from mtools.segments import DEFAULT_SEGMENT_DURATION, encode_segmented, should_segment
+from mtools.staging import ScratchSpace, StagedFile
+from mtools.utils import ensure_file, parse_size
+
+LOGGER = logging.getLogger(__name__)
 
 
 class ProgramArgsNamespace(Namespace):
-    input_file_path: Path
-    output_file_path: Path
-    metadata_source_file: Path
+    input_file_paths: list[Path]
+    output_file_path: Path | None
+    metadata_source_file: Path | None
+    infer_metadata_source_file: bool
     run_metacopy: bool
     keep_input: bool
+    force_encode: bool
+    jobs: int
+    use_probe_cache: bool
+    replaygain: bool
+    io_jobs_per_device: int | None
+    match_threshold: float
+    scratch_dir: Path | None
+    scratch_budget: int | None
+    segmented: bool
+    segment_duration: float
+    metrics_file: Path | None
+    metrics_port: int | None
 
 
-def get_args() -> ProgramArgsNamespace:
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
     parser = ArgumentParser()
     parser.add_argument(
-        "input_file_path",
+        "input_file_paths",
         metavar="INPUT_FILE",
         type=Path,
+        nargs="+",
     )
     parser.add_argument(
         "-o",
         "--output-file",
         dest="output_file_path",
         type=Path,
+        help="only valid with a single input file",
     )
     meta_source_parser = parser.add_mutually_exclusive_group()
     meta_source_parser.add_argument(
         "-m",
         "--metadata-source-file",
         type=Path,
+        help="only valid with a single input file",
     )
-    infer_source_arg = meta_source_parser.add_argument(
+    meta_source_parser.add_argument(
         "-a",
         "--infer-metadata-source-file",
         action="store_true",
-        help="automatically guess which file to use as meta source",
+        help=(
+            "automatically find which file to use as meta source, "
+            "among .mp3/.m4a files next to the output"
+        ),
     )
     parser.add_argument(
         "-k",
@@ -53,56 +100,394 @@ def get_args() -> ProgramArgsNamespace:
         action="store_false",
         dest="run_metacopy",
     )
-    args = parser.parse_args(namespace=ProgramArgsNamespace())
-
-    if args.output_file_path is None:
-        args.output_file_path = args.input_file_path.with_suffix(".m4a")
-
-    if args.metadata_source_file is None:
-        if args.infer_metadata_source_file:
-            prefix_paths = get_prefix_file_paths(args.output_file_path)
-            if prefix_paths:
-                print("Got candidate input paths:")
-                print("\n".join(f"  {path}" for path in prefix_paths))
-                args.metadata_source_file = prefix_paths[0]
-                print(f"Will copy metadata from path '{args.metadata_source_file}'")
-                input("Enter to continue, or Ctrl-C to cancel")
-            else:
-                raise ArgumentError(
-                    infer_source_arg, "was passed but no inferred paths found"
-                )
-        else:
-            args.metadata_source_file = args.input_file_path
+    parser.add_argument(
+        "-f",
+        "--force-encode",
+        action="store_true",
+        help="always re-encode to AAC, even if the input audio is already AAC",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=(
+            "number of ffmpeg encodes (whole files, or segments with --segmented) "
+            "to run in parallel"
+        ),
+    )
+    parser.add_argument(
+        "--no-probe-cache",
+        action="store_false",
+        dest="use_probe_cache",
+        help="re-probe all inputs instead of using cached ffprobe results",
+    )
+    parser.add_argument(
+        "--replaygain",
+        action="store_true",
+        help=(
+            "measure loudness while converting and write ReplayGain track tags, "
+            "plus album tags once the whole batch has converted"
+        ),
+    )
+    parser.add_argument(
+        "--io-jobs-per-device",
+        type=int,
+        help=(
+            "number of files to write tags to at once on each disk/mount "
+            "(default: detected per device)"
+        ),
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=Path,
+        help=(
+            "encode and tag in this (fast, local) directory, "
+            "then move each finished file to its destination in one copy"
+        ),
+    )
+    parser.add_argument(
+        "--scratch-budget",
+        type=parse_size,
+        help=(
+            "maximum bytes to stage in --scratch-dir at once, e.g. '4G' "
+            "(default: 90%% of its free space)"
+        ),
+    )
+    parser.add_argument(
+        "--match-threshold",
+        type=float,
+        default=DEFAULT_MATCH_THRESHOLD,
+        help=(
+            "with -a, minimum score (0-1) for an inferred meta source to be used; "
+            "below it, the input file is used"
+        ),
+    )
+    parser.add_argument(
+        "--segmented",
+        action="store_true",
+        help=(
+            "encode long inputs (at least twice --segment-duration) as time segments "
+            "in parallel, then join them"
+        ),
+    )
+    parser.add_argument(
+        "--segment-duration",
+        type=float,
+        default=DEFAULT_SEGMENT_DURATION,
+        help="with --segmented, length of each segment in seconds (default: %(default)s)",
+    )
+    add_metrics_args(parser)
+    args = parser.parse_args(argv, namespace=ProgramArgsNamespace())
+
+    if len(args.input_file_paths) > 1:
+        if args.output_file_path is not None:
+            parser.error("-o/--output-file requires a single input file")
+        if args.metadata_source_file is not None:
+            parser.error("-m/--metadata-source-file requires a single input file")
 
     return args
 
 
-def main(args: ProgramArgsNamespace):
-    ensure_file(args.input_file_path)
+def get_output_kwargs(probe: ProbeResult, force_encode: bool = False) -> dict[str, str]:
+    """
+    gets ffmpeg output options: stream copy if the input audio is already AAC, else encode to AAC
+    """
+    if force_encode or not probe.is_aac:
+        return {"acodec": "aac"}
+    output_kwargs = {"acodec": "copy"}
+    if probe.format_name == "aac":
+        # raw ADTS stream; headers must be converted for the MP4 container
+        output_kwargs["bsf:a"] = "aac_adtstoasc"
+    return output_kwargs
+
+
+def record_encode_metrics(input_file_path: Path, probe: ProbeResult, elapsed: float):
+    """
+    bytes written are counted once the output is in place, in finish_stage/ScratchSpace.commit
+    """
+    PHASE_SECONDS.observe(elapsed, phase="encode")
+    if probe.duration and elapsed:
+        ENCODE_SPEED.observe(probe.duration / elapsed)
+    BYTES_READ.inc(input_file_path.stat().st_size)
 
-    print(f"'{args.input_file_path}' -> '{args.output_file_path}'")
 
-    cmd = ffmpeg.input(args.input_file_path)
-    cmd = cmd.output(
-        str(args.output_file_path),
-        acodec="aac",
+def encode_file(
+    input_file_path: Path,
+    output_file_path: Path,
+    probe: ProbeResult,
+    force_encode: bool = False,
+    replaygain: bool = False,
+    segment_duration: float | None = None,
+    encode_slots: threading.Semaphore | None = None,
+) -> Loudness | None:
+    """
+    each ffmpeg encode holds one of `encode_slots` (if given) while it runs, so the encodes of
+    concurrent files and of their segments are all counted against the same limit
+    """
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    print(f"'{input_file_path}' -> '{output_file_path}'")
+
+    output_kwargs = get_output_kwargs(probe, force_encode=force_encode)
+    if segment_duration is not None and should_segment(
+        probe, output_kwargs, segment_duration
+    ):
+        start = time.perf_counter()
+        try:
+            encode_segmented(
+                input_file_path,
+                Path(output_file_path),
+                probe,
+                output_kwargs,
+                segment_duration=segment_duration,
+                slots=encode_slots,
+            )
+        except SegmentMismatch as exc:
+            LOGGER.warning(
+                f"Segmented encode of '{input_file_path}' failed verification ({exc}); "
+                "encoding in one piece"
+            )
+        else:
+            record_encode_metrics(input_file_path, probe, time.perf_counter() - start)
+            if replaygain:
+                return measure_loudness(Path(output_file_path), probe.duration)
+            return None
+
+    input_stream = ffmpeg.input(input_file_path)
+    cmd = input_stream.output(
+        str(output_file_path),
         map="0:a",
+        **output_kwargs,
     )
+    if replaygain:
+        # analysed from the same decode as the encode (or the only decode, when remuxing);
+        #  framelog=verbose keeps the per-frame lines out of the captured stderr
+        analysis = input_stream.audio.filter(
+            "ebur128", peak="true", framelog="verbose"
+        ).output("-", f="null")
+        cmd = ffmpeg.merge_outputs(cmd, analysis)
     print(" ".join(str(c) for c in cmd.compile()))
 
+    with nullcontext() if encode_slots is None else encode_slots:
+        start = time.perf_counter()
+        try:
+            # output is captured so parallel jobs don't interleave their progress lines
+            stdout, stderr = cmd.run(quiet=True)
+        except ffmpeg.Error as exc:
+            print("    " + " ".join(str(c) for c in cmd.compile()))
+            print(exc.stderr.decode(errors="replace"))
+            raise
+        elapsed = time.perf_counter() - start
+    record_encode_metrics(input_file_path, probe, elapsed)
+
+    if replaygain:
+        return parse_ebur128_summary(
+            stderr.decode(errors="replace"), duration=probe.duration
+        )
+    return None
+
+
+def finish_file(
+    input_file_path: Path,
+    output_file_path: Path,
+    metadata_source_file: Path,
+    loudness: Loudness | None = None,
+    run_metacopy: bool = True,
+    keep_input: bool = False,
+) -> tuple[Path, Loudness | None]:
+    """
+    writes tags and file dates to a converted file, and removes the input unless it's being kept
+    """
+    if run_metacopy:
+        copy_metadata(metadata_source_file, output_file_path)
+
+    if loudness is not None:
+        write_replaygain_tags(output_file_path, track=loudness)
+
+    copy_filedate(input_file_path, output_file_path)
+
+    if not keep_input:
+        input_file_path.unlink()
+
+    return output_file_path, loudness
+
+
+# ffmpeg's native AAC encoder default
+AAC_BITRATE_PER_CHANNEL_PAIR = 128_000
+
+
+def estimate_output_size(
+    input_file_path: Path, probe: ProbeResult, force_encode: bool = False
+) -> int:
+    if get_output_kwargs(probe, force_encode)["acodec"] == "copy":
+        return input_file_path.stat().st_size
+    channel_pairs = max((probe.channels or 2) / 2, 1)
+    return int(probe.duration * AAC_BITRATE_PER_CHANNEL_PAIR * channel_pairs / 8 * 1.1)
+
+
+def encode_stage(
+    input_file_path: Path,
+    output_file_path: Path,
+    probe: ProbeResult,
+    force_encode: bool = False,
+    replaygain: bool = False,
+    scratch: ScratchSpace | None = None,
+    segment_duration: float | None = None,
+    encode_slots: threading.Semaphore | None = None,
+) -> tuple[StagedFile | None, Loudness | None]:
+    encode = partial(
+        encode_file,
+        probe=probe,
+        force_encode=force_encode,
+        replaygain=replaygain,
+        segment_duration=segment_duration,
+        encode_slots=encode_slots,
+    )
+    if scratch is None:
+        return None, encode(input_file_path, output_file_path)
+    staged = scratch.stage(
+        output_file_path,
+        estimate_output_size(input_file_path, probe, force_encode=force_encode),
+    )
+    try:
+        return staged, encode(input_file_path, staged.path)
+    except BaseException:
+        scratch.discard(staged)
+        raise
+
+
+def finish_stage(
+    input_file_path: Path,
+    output_file_path: Path,
+    metadata_source_file: Path,
+    encoded: tuple[StagedFile | None, Loudness | None],
+    run_metacopy: bool = True,
+    keep_input: bool = False,
+    scratch: ScratchSpace | None = None,
+) -> tuple[Path, Loudness | None]:
+    staged, loudness = encoded
+    if staged is None:
+        result = finish_file(
+            input_file_path,
+            output_file_path,
+            metadata_source_file,
+            loudness,
+            run_metacopy=run_metacopy,
+            keep_input=keep_input,
+        )
+        BYTES_WRITTEN.inc(output_file_path.stat().st_size)
+        return result
     try:
-        stdout, stderr = cmd.run()
-    except Exception as exc:
-        print("    " + " ".join(str(c) for c in cmd.compile()))
+        finish_file(
+            input_file_path,
+            staged.path,
+            metadata_source_file,
+            loudness,
+            run_metacopy=run_metacopy,
+            keep_input=True,
+        )
+    except BaseException:
+        scratch.discard(staged)
         raise
+    scratch.commit(staged)
+    if not keep_input:
+        input_file_path.unlink()
+    return output_file_path, loudness
+
+
+def main(args: ProgramArgsNamespace):
+    for input_file_path in args.input_file_paths:
+        ensure_file(input_file_path)
+
+    probes = preflight(
+        args.input_file_paths,
+        cache=ProbeCache() if args.use_probe_cache else None,
+        max_workers=args.jobs,
+    )
+    print_preflight_report(probes, force_encode=args.force_encode)
+
+    scratch = (
+        ScratchSpace(args.scratch_dir, budget=args.scratch_budget)
+        if args.scratch_dir
+        else None
+    )
+
+    output_file_paths = [
+        args.output_file_path or input_file_path.with_suffix(".m4a")
+        for input_file_path in args.input_file_paths
+    ]
+    if args.metadata_source_file is not None:
+        metadata_source_files = [args.metadata_source_file]
+    elif args.infer_metadata_source_file:
+        # matched by the input's duration and tags, and the output's name
+        matches = infer_sources(
+            [
+                MatchFeatures.from_probe(probe, path=output_file_path)
+                for probe, output_file_path in zip(probes, output_file_paths)
+            ],
+            sorted({path.parent for path in output_file_paths}),
+            threshold=args.match_threshold,
+            exclude=set(args.input_file_paths),
+        )
+        metadata_source_files = [
+            match.source.path if match is not None else input_file_path
+            for match, input_file_path in zip(matches, args.input_file_paths)
+        ]
+    else:
+        metadata_source_files = args.input_file_paths
 
-    if args.run_metacopy:
-        copy_metadata(args.metadata_source_file, args.output_file_path)
+    # shared by all files' encodes, so --segmented doesn't multiply the ffmpeg processes per job
+    encode_slots = threading.BoundedSemaphore(args.jobs)
+    jobs = []
+    for input_file_path, output_file_path, metadata_source_file, probe in zip(
+        args.input_file_paths, output_file_paths, metadata_source_files, probes
+    ):
+        jobs.append(
+            Job(
+                name=str(input_file_path),
+                func=partial(
+                    encode_stage,
+                    input_file_path,
+                    output_file_path,
+                    probe,
+                    force_encode=args.force_encode,
+                    replaygain=args.replaygain,
+                    scratch=scratch,
+                    segment_duration=(
+                        args.segment_duration if args.segmented else None
+                    ),
+                    encode_slots=encode_slots,
+                ),
+                weight=probe.duration,
+                io_func=partial(
+                    finish_stage,
+                    input_file_path,
+                    output_file_path,
+                    metadata_source_file,
+                    run_metacopy=args.run_metacopy,
+                    keep_input=args.keep_input,
+                    scratch=scratch,
+                ),
+                io_path=output_file_path,
+            )
+        )
 
-    copy_filedate(args.input_file_path, args.output_file_path)
+    with MetricsExporter.from_args(args):
+        results = run_jobs(
+            jobs,
+            max_workers=args.jobs,
+            io_concurrency_per_device=args.io_jobs_per_device,
+        )
 
-    if not args.keep_input:
-        args.input_file_path.unlink()
+    if args.replaygain:
+        write_album_gains(
+            {
+                output_file_path: loudness
+                for output_file_path, loudness in results
+                if loudness is not None
+            }
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+import logging
+import os
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+from mutagen.mp3 import MP3, BitrateMode
+from utils_python import setup_logger
+
+from mtools.batch import PENDING_PER_WORKER, map_bounded
+from mtools.payload import get_audio_payload_ranges, hash_ranges
+from mtools.utils import make_mutagen_file
+from mtools.walk import WalkFilter, add_walk_args, iter_audio_files
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ProgramArgsNamespace(Namespace):
+    paths: list[Path]
+    jobs: int
+    min_size: int | None
+    max_size: int | None
+    modified_after: float | None
+    modified_before: float | None
+
+
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
+    parser = ArgumentParser(
+        description="find tracks with identical audio, ignoring differences in tags"
+    )
+    parser.add_argument(
+        "paths",
+        metavar="PATH",
+        type=Path,
+        nargs="+",
+        help="files, or directories to search recursively",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    add_walk_args(parser)
+    return parser.parse_args(argv, namespace=ProgramArgsNamespace())
+
+
+def scan_file(path: Path):
+    """
+    gets the cheap pre-filter key (duration, payload size) and payload ranges for a file
+    """
+    file = make_mutagen_file(path)
+    ranges = get_audio_payload_ranges(file)
+    payload_size = sum(length for _, length in ranges)
+    duration = file.info.length
+    if isinstance(file, MP3) and file.info.bitrate_mode == BitrateMode.UNKNOWN:
+        # no Xing/VBRI header, so mutagen estimated the duration from the file size, tags after
+        # the audio included; estimate it from the audio alone instead
+        duration = 8 * payload_size / file.info.bitrate
+    return (path.suffix, round(duration, 2), payload_size), ranges
+
+
+def _try_scan_file(path: Path):
+    try:
+        return path, scan_file(path)
+    except Exception:  # pylint: disable=broad-exception-caught
+        return path, None
+
+
+def _try_hash_ranges(path: Path, ranges: list[tuple[int, int]]):
+    try:
+        return path, hash_ranges(path, ranges)
+    except Exception:  # pylint: disable=broad-exception-caught
+        return path, None
+
+
+def group_candidates(
+    executor: Executor, paths: Iterable[Path], max_pending: int
+) -> list[list[tuple[Path, list[tuple[int, int]]]]]:
+    """
+    scans files, grouping those that share a (cheap) pre-filter key; returns the groups of two or
+    more, as (path, payload ranges)
+    """
+    candidates = defaultdict(list)
+    scanned_count = 0
+    for path, scan_result in map_bounded(
+        executor, _try_scan_file, paths, max_pending=max_pending
+    ):
+        scanned_count += 1
+        if scan_result is None:
+            LOGGER.warning(f"Skipping unreadable file '{path}'")
+            continue
+        prefilter_key, ranges = scan_result
+        candidates[prefilter_key].append((path, ranges))
+    groups = [group for group in candidates.values() if len(group) > 1]
+    LOGGER.info(
+        f"{sum(map(len, groups))}/{scanned_count} file(s) share a duration and payload size"
+    )
+    return groups
+
+
+def hash_candidates(
+    executor: Executor, groups: list[list[tuple[Path, list[tuple[int, int]]]]]
+) -> list[list[Path]]:
+    """
+    hashes the payloads of grouped files; returns the groups of files with identical payloads
+    """
+    to_hash = [entry for group in groups for entry in group]
+    by_hash = defaultdict(list)
+    for path, digest in executor.map(
+        _try_hash_ranges,
+        [path for path, _ in to_hash],
+        [ranges for _, ranges in to_hash],
+    ):
+        # e.g. deleted since it was scanned
+        if digest is None:
+            LOGGER.warning(f"Skipping unreadable file '{path}'")
+            continue
+        by_hash[digest].append(path)
+    return [sorted(group) for group in by_hash.values() if len(group) > 1]
+
+
+def find_duplicates(
+    paths: Iterable[Path],
+    max_workers: int | None = None,
+) -> list[list[Path]]:
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        groups = group_candidates(
+            executor, paths, max_pending=max_workers * PENDING_PER_WORKER
+        )
+        return hash_candidates(executor, groups)
+
+
+def main(args: ProgramArgsNamespace) -> None:
+    paths = iter_audio_files(args.paths, WalkFilter.from_args(args))
+    duplicate_groups = find_duplicates(paths, max_workers=args.jobs)
+    for group in sorted(duplicate_groups):
+        print(f"{len(group)} copies:")
+        print("\n".join(f"  {path}" for path in group))
+    print(f"{len(duplicate_groups)} group(s) of duplicates found")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    setup_logger()
+    main(args)
@@ -5,3 +5,9 @@ class UnrecognisedValue(Exception): ...
 
 
 class UnrecognisedFormat(Exception): ...
+
+
+class PayloadMismatch(Exception): ...
+
+
+class SegmentMismatch(Exception): ...
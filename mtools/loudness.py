@@ -0,0 +1,136 @@
+import math
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from mutagen.mp4 import MP4FreeForm
+
+from mtools.tag_mapper import (
+    TagFormat,
+    get_album_key,
+    get_tag_format,
+    get_tag_mapper,
+)
+from mtools.utils import make_mutagen_file
+
+# ReplayGain 2.0 reference level
+REFERENCE_LOUDNESS = -18.0
+
+_INTEGRATED_PATTERN = re.compile(r"^\s*I:\s+(-?[\d.]+|-inf) LUFS", re.MULTILINE)
+_PEAK_PATTERN = re.compile(r"^\s*Peak:\s+(-?[\d.]+|-inf) dBFS", re.MULTILINE)
+
+
+@dataclass
+class Loudness:
+    integrated: float  # LUFS
+    peak: float  # linear true peak; 1.0 is full scale
+    duration: float
+
+    @property
+    def gain(self):
+        return REFERENCE_LOUDNESS - self.integrated
+
+
+def parse_ebur128_summary(stderr: str, duration: float) -> Loudness:
+    """
+    parses the summary printed by ffmpeg's ebur128 filter (with peak=true) at the end of a run
+    """
+    integrated_matches = _INTEGRATED_PATTERN.findall(stderr)
+    peak_matches = _PEAK_PATTERN.findall(stderr)
+    if not integrated_matches or not peak_matches:
+        raise ValueError("No ebur128 summary found in ffmpeg output")
+    peak_dbfs = float(peak_matches[-1])
+    return Loudness(
+        integrated=float(integrated_matches[-1]),
+        peak=10 ** (peak_dbfs / 20),
+        duration=duration,
+    )
+
+
+def measure_loudness(path: Path, duration: float) -> Loudness:
+    """
+    measures an existing file's loudness, for when it couldn't be analysed while encoding
+    """
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    _, stderr = (
+        ffmpeg.input(path)
+        .audio.filter("ebur128", peak="true", framelog="verbose")
+        .output("-", f="null")
+        .run(quiet=True)
+    )
+    return parse_ebur128_summary(stderr.decode(errors="replace"), duration=duration)
+
+
+def combine_loudness(loudnesses: list[Loudness]) -> Loudness:
+    """
+    gets album loudness as the duration-weighted energy mean of its tracks
+    """
+    total_duration = sum(loudness.duration for loudness in loudnesses)
+    energy = sum(
+        loudness.duration * 10 ** (loudness.integrated / 10)
+        for loudness in loudnesses
+        if loudness.integrated != -math.inf
+    )
+    return Loudness(
+        integrated=(
+            10 * math.log10(energy / total_duration)
+            if energy and total_duration
+            else -math.inf
+        ),
+        peak=max(loudness.peak for loudness in loudnesses),
+        duration=total_duration,
+    )
+
+
+def get_replaygain_values(
+    track: Loudness | None = None,
+    album: Loudness | None = None,
+) -> dict[str, str]:
+    values = {}
+    if track is not None:
+        values["REPLAYGAIN_TRACK_GAIN"] = f"{track.gain:.2f} dB"
+        values["REPLAYGAIN_TRACK_PEAK"] = f"{track.peak:.6f}"
+    if album is not None:
+        values["REPLAYGAIN_ALBUM_GAIN"] = f"{album.gain:.2f} dB"
+        values["REPLAYGAIN_ALBUM_PEAK"] = f"{album.peak:.6f}"
+    return values
+
+
+def write_replaygain_tags(
+    path: Path,
+    track: Loudness | None = None,
+    album: Loudness | None = None,
+):
+    file = make_mutagen_file(path)
+    tag_mapper = get_tag_mapper()
+    target_format = get_tag_format(file)
+    for name, text in get_replaygain_values(track, album).items():
+        # expressed as MP4 freeform tags, which TagMapper can translate to any format
+        key, value, _ = tag_mapper.translate_tag(
+            tag_mapper.get_misc_field_tag(name, TagFormat.MP4),
+            [MP4FreeForm(text.encode("utf-8"))],
+            TagFormat.MP4,
+            target_format,
+        )
+        file[key] = value
+    file.save()
+
+
+def write_album_gains(track_loudnesses: dict[Path, Loudness]):
+    """
+    groups files by album artist and album, and writes album gain/peak to each group's files
+    """
+    albums = defaultdict(list)
+    for path in track_loudnesses:
+        if (album_key := get_album_key(make_mutagen_file(path))) is not None:
+            albums[album_key].append(path)
+    for paths in albums.values():
+        album = combine_loudness([track_loudnesses[path] for path in paths])
+        for path in paths:
+            # keep the file dates already copied from the conversion input
+            stat = path.stat()
+            write_replaygain_tags(path, album=album)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
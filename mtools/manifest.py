@@ -0,0 +1,161 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable
+
+from mutagen.id3 import Frames
+from mutagen.id3._frames import APIC, COMM, TXXX, TextFrame
+from mutagen.id3._specs import Encoding, PictureType
+from mutagen.mp4 import AtomDataType, MP4Cover, MP4FreeForm
+
+from mtools.errors import UnrecognisedTag, UnrecognisedValue
+from mtools.tag_mapper import TagFormat
+
+ID3_FORMATS = {TagFormat.ID3v2_3, TagFormat.ID3v2_4}
+
+_COVER_SUFFIXES = {"image/jpeg": ".jpg", "image/png": ".png"}
+_MP4_COVER_MIMES = {
+    MP4Cover.FORMAT_JPEG: "image/jpeg",
+    MP4Cover.FORMAT_PNG: "image/png",
+}
+
+# (cover data, mime) -> cover file name
+CoverNamer = Callable[[bytes, str], str]
+
+# key of the header record that starts a manifest, ahead of the per-file records
+HEADER_KEY = "manifest"
+
+
+def get_cover_name(data: bytes, mime: str) -> str:
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return digest + _COVER_SUFFIXES.get(mime, ".bin")
+
+
+class CoverStore:
+    """
+    a directory of cover images named by content hash, so each distinct cover is stored once
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def put(self, data: bytes, mime: str) -> str:
+        name = get_cover_name(data, mime)
+        path = self.directory / name
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # written via a temp file, as other workers may be storing the same cover
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        return name
+
+    def get(self, name: str) -> bytes:
+        return (self.directory / name).read_bytes()
+
+
+def make_header(covers_dir: Path, manifest_path: Path | None) -> dict:
+    """
+    the covers directory is stored relative to the manifest, so they can be moved together; or, if
+    the manifest isn't written to a file (e.g. stdout), as an absolute path
+    """
+    covers_dir = covers_dir.resolve()
+    if manifest_path is not None:
+        covers_dir = Path(os.path.relpath(covers_dir, manifest_path.resolve().parent))
+    return {HEADER_KEY: {"covers_dir": covers_dir.as_posix()}}
+
+
+def is_header(record: dict) -> bool:
+    return HEADER_KEY in record
+
+
+def get_header_covers_dir(header: dict, manifest_path: Path) -> Path:
+    return manifest_path.parent / header[HEADER_KEY]["covers_dir"]
+
+
+def value_to_json(
+    key: str,
+    value: Any,
+    tag_format: TagFormat,
+    cover_namer: CoverNamer = get_cover_name,
+):
+    """
+    gets the manifest form of a tag value: a list of strings/numbers, or a cover reference
+    """
+    if tag_format in ID3_FORMATS:
+        if isinstance(value, APIC):
+            return {"cover": cover_namer(value.data, value.mime), "mime": value.mime}
+        if isinstance(value, TextFrame):
+            return [str(text) for text in value.text]
+        raise UnrecognisedValue(key)
+
+    if key == "covr":
+        cover = value[0]
+        mime = _MP4_COVER_MIMES[cover.imageformat]
+        return {"cover": cover_namer(bytes(cover), mime), "mime": mime}
+    result = []
+    for v in value:
+        match v:
+            case MP4FreeForm() if v.dataformat == AtomDataType.UTF8:
+                result.append(v.decode("utf-8"))
+            case MP4FreeForm():
+                raise UnrecognisedValue(key)
+            case bytes() if key.startswith("----:"):
+                # freeform values as translated from other formats, before mutagen wraps them
+                result.append(v.decode("utf-8"))
+            case tuple():
+                index, total = v
+                result.append(f"{index}/{total}" if total else f"{index}")
+            case str() | bool() | int() | float():
+                result.append(v)
+            case _:
+                raise UnrecognisedValue(key)
+    return result
+
+
+def value_from_json(
+    key: str,
+    json_value,
+    tag_format: TagFormat,
+    cover_store: CoverStore,
+):
+    """
+    builds a native (mutagen) value for a key in the given format from its manifest form
+    """
+    if isinstance(json_value, dict):
+        data = cover_store.get(json_value["cover"])
+        mime = json_value["mime"]
+        if tag_format in ID3_FORMATS:
+            return APIC(
+                encoding=Encoding.LATIN1,
+                mime=mime,
+                type=PictureType.COVER_FRONT,
+                desc=key.partition(":")[2],
+                data=data,
+            )
+        imageformat = {v: k for k, v in _MP4_COVER_MIMES.items()}[mime]
+        return [MP4Cover(data, imageformat=imageformat)]
+
+    if tag_format in ID3_FORMATS:
+        text = [str(v) for v in json_value]
+        frame_id, *rest = key.split(":")
+        if frame_id == "TXXX":
+            return TXXX(encoding=Encoding.UTF8, desc=":".join(rest), text=text)
+        if frame_id == "COMM":
+            desc, lang = rest if len(rest) == 2 else ("", "eng")
+            return COMM(encoding=Encoding.UTF8, desc=desc, lang=lang, text=text)
+        if (cls := Frames.get(frame_id)) is not None and issubclass(cls, TextFrame):
+            return cls(encoding=Encoding.UTF8, text=text)
+        raise UnrecognisedTag(key)
+
+    if key in {"trkn", "disk"}:
+        result = []
+        for v in json_value:
+            index, _, total = str(v).partition("/")
+            result.append((int(index), int(total or 0)))
+        return result
+    if key.startswith("----:"):
+        return [MP4FreeForm(str(v).encode("utf-8")) for v in json_value]
+    return list(json_value)
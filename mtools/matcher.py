@@ -0,0 +1,225 @@
+import bisect
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from mtools.preflight import ProbeResult
+from mtools.tag_mapper import get_label_text
+from mtools.utils import make_mutagen_file
+from mtools.walk import iter_audio_files
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MATCH_THRESHOLD = 0.75
+# seconds; candidates further than this from the target's duration are not considered
+DEFAULT_DURATION_TOLERANCE = 3.0
+
+# weights of each signal in a match score; signals missing on either side are left out. duration
+# and filename similarity alone aren't enough to accept a match: see SourceIndex.is_identified
+_DURATION_WEIGHT = 0.4
+_TITLE_WEIGHT = 0.3
+_ARTIST_WEIGHT = 0.15
+_FILENAME_WEIGHT = 0.15
+
+
+def normalize_text(text: str | None) -> str:
+    """
+    casefolds, strips accents and bracketed parts (e.g. "(Remastered)"), and collapses punctuation
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[(\[].*?[)\]]", " ", text.casefold())
+    return " ".join(re.findall(r"\w+", text))
+
+
+def text_similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+@dataclass
+class MatchFeatures:
+    path: Path
+    duration: float | None
+    title: str
+    artist: str
+
+    @classmethod
+    def from_file(cls, path: Path):
+        file = make_mutagen_file(path)
+        return cls(
+            path=path,
+            duration=file.info.length,
+            title=normalize_text(get_label_text(file, "TITLE")),
+            artist=normalize_text(get_label_text(file, "ARTIST")),
+        )
+
+    @classmethod
+    def from_probe(cls, probe: ProbeResult, path: Path | None = None):
+        return cls(
+            path=path or Path(probe.path),
+            duration=probe.duration or None,
+            title=normalize_text(probe.tags.get("title")),
+            artist=normalize_text(probe.tags.get("artist")),
+        )
+
+
+@dataclass
+class Match:
+    source: MatchFeatures
+    score: float
+    # whether anything besides the duration and a similar filename points to this source
+    identified: bool
+
+
+class SourceIndex:
+    """
+    candidate metadata sources, indexed by duration, for matching targets to their most likely
+    source
+    """
+
+    def __init__(
+        self,
+        candidates: list[MatchFeatures],
+        duration_tolerance: float = DEFAULT_DURATION_TOLERANCE,
+    ):
+        self.duration_tolerance = duration_tolerance
+        self._timed = sorted(
+            (c for c in candidates if c.duration is not None),
+            key=lambda c: c.duration,
+        )
+        self._durations = [c.duration for c in self._timed]
+        self._untimed = [c for c in candidates if c.duration is None]
+
+    @classmethod
+    def from_paths(cls, paths: list[Path], recursive: bool = True, **kwargs):
+        candidates = []
+        for path in iter_audio_files(paths, recursive=recursive):
+            try:
+                candidates.append(MatchFeatures.from_file(path.resolve()))
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.info(f"Not indexing unreadable file '{path}'")
+        return cls(candidates, **kwargs)
+
+    def __len__(self):
+        return len(self._timed) + len(self._untimed)
+
+    def _get_candidates(self, target: MatchFeatures):
+        if target.duration is None:
+            return [*self._timed, *self._untimed]
+        start = bisect.bisect_left(
+            self._durations, target.duration - self.duration_tolerance
+        )
+        end = bisect.bisect_right(
+            self._durations, target.duration + self.duration_tolerance
+        )
+        return [*self._timed[start:end], *self._untimed]
+
+    def score(self, target: MatchFeatures, source: MatchFeatures) -> float:
+        signals = []
+        if target.duration is not None and source.duration is not None:
+            difference = abs(target.duration - source.duration)
+            signals.append(
+                (_DURATION_WEIGHT, max(0.0, 1 - difference / self.duration_tolerance))
+            )
+        if target.title and source.title:
+            signals.append((_TITLE_WEIGHT, text_similarity(target.title, source.title)))
+        if target.artist and source.artist:
+            signals.append(
+                (_ARTIST_WEIGHT, text_similarity(target.artist, source.artist))
+            )
+        if target.path.stem.startswith(source.path.stem):
+            filename_score = 1.0
+        else:
+            filename_score = text_similarity(
+                normalize_text(target.path.stem), normalize_text(source.path.stem)
+            )
+        signals.append((_FILENAME_WEIGHT, filename_score))
+        return sum(w * s for w, s in signals) / sum(w for w, _ in signals)
+
+    @staticmethod
+    def is_identified(target: MatchFeatures, source: MatchFeatures) -> bool:
+        """
+        whether the source shares a title/artist tag with the target, or is a prefix of its name;
+        untagged files with similar durations and names (e.g. "01 Track" and "02 Track") otherwise
+        score well above the threshold on duration alone
+        """
+        return bool(
+            (target.title and source.title)
+            or (target.artist and source.artist)
+            or target.path.stem.startswith(source.path.stem)
+        )
+
+    def match(
+        self,
+        target: MatchFeatures,
+        exclude: set[Path] | None = None,
+    ) -> list[Match]:
+        # candidate paths are resolved when indexed
+        exclude = {path.resolve() for path in (target.path, *(exclude or set()))}
+        matches = [
+            Match(
+                source,
+                self.score(target, source),
+                self.is_identified(target, source),
+            )
+            for source in self._get_candidates(target)
+            if source.path not in exclude
+        ]
+        # sources a tag or name points to rank above those that only have a similar duration
+        return sorted(matches, key=lambda m: (m.identified, m.score), reverse=True)
+
+    def best_match(
+        self,
+        target: MatchFeatures,
+        threshold: float = DEFAULT_MATCH_THRESHOLD,
+        exclude: set[Path] | None = None,
+    ) -> Match | None:
+        """
+        gets the best-scoring source, if it reaches the threshold; None otherwise
+        """
+        matches = self.match(target, exclude=exclude)
+        if not matches:
+            LOGGER.warning(f"No candidate sources for '{target.path}'")
+            return None
+        best = matches[0]
+        if best.score < threshold:
+            LOGGER.warning(
+                f"Best source for '{target.path}' is '{best.source.path}' with score "
+                f"{best.score:.2f}, below threshold {threshold}"
+            )
+            return None
+        if not best.identified:
+            LOGGER.warning(
+                f"Best source for '{target.path}' is '{best.source.path}', but only by duration "
+                "and filename similarity; neither file has title/artist tags to confirm it"
+            )
+            return None
+        LOGGER.info(
+            f"Matched '{target.path}' to '{best.source.path}' (score {best.score:.2f})"
+        )
+        return best
+
+
+def infer_sources(
+    targets: list[MatchFeatures],
+    source_paths: list[Path],
+    threshold: float = DEFAULT_MATCH_THRESHOLD,
+    exclude: set[Path] | None = None,
+    recursive: bool = False,
+) -> list[Match | None]:
+    """
+    matches each target to its best source among the files in source_paths (files or directories,
+    searched recursively if requested); targets themselves are never used as sources
+    """
+    index = SourceIndex.from_paths(source_paths, recursive=recursive)
+    LOGGER.info(f"Indexed {len(index)} candidate source(s)")
+    exclude = {*(exclude or set()), *(target.path for target in targets)}
+    return [
+        index.best_match(target, threshold=threshold, exclude=exclude)
+        for target in targets
+    ]
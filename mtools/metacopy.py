@@ -1,88 +1,292 @@
 import logging
+import threading
 from argparse import ArgumentError, ArgumentParser, Namespace
+from functools import partial
 from pathlib import Path
+from typing import Any
 
-from mutagen._file import FileType
 from utils_python import setup_logger
 
+from mtools.batch import Job, run_jobs
 from mtools.errors import UnrecognisedTag
-from mtools.tag_mapper import TagMapper, get_tag_format
-from mtools.utils import get_prefix_file_paths, make_mutagen_file
+from mtools.matcher import DEFAULT_MATCH_THRESHOLD, MatchFeatures, infer_sources
+from mtools.metrics import PHASE_SECONDS, MetricsExporter, add_metrics_args
+from mtools.payload import save_verified
+from mtools.tag_mapper import (
+    TagFormat,
+    TagMapper,
+    TranslationCache,
+    get_album_key,
+    get_tag_format,
+    get_tag_mapper,
+)
+from mtools.utils import make_mutagen_file
 
 LOGGER = logging.getLogger(__name__)
 
 
 class ProgramArgsNamespace(Namespace):
-    input_file_path: Path
-    output_file_path: Path
+    input_file_paths: list[Path]
+    output_file_paths: list[Path]
+    verify: bool
+    io_jobs_per_device: int | None
+    source_paths: list[Path] | None
+    match_threshold: float
+    metrics_file: Path | None
+    metrics_port: int | None
 
 
-def get_args() -> ProgramArgsNamespace:
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
     parser = ArgumentParser()
     input_file_arg = parser.add_argument(
         "-i",
         "--input-file",
-        dest="input_file_path",
+        dest="input_file_paths",
         type=Path,
+        nargs="+",
+        help=(
+            "one per output file, in the same order, or a single one for all outputs; "
+            "if not given, each output's source is inferred"
+        ),
     )
     parser.add_argument(
         "-o",
         "--output-file",
-        dest="output_file_path",
+        dest="output_file_paths",
         type=Path,
+        nargs="+",
         required=True,
     )
-    args = parser.parse_args(namespace=ProgramArgsNamespace())
-    if args.input_file_path is None:
-        prefix_paths = get_prefix_file_paths(args.output_file_path)
-        if prefix_paths:
-            print("Got candidate input paths:")
-            print("\n".join(f"  {path}" for path in prefix_paths))
-            args.input_file_path = prefix_paths[0]
-            print(f"Will copy metadata from path '{args.input_file_path}'")
-            input("Enter to continue, or Ctrl-C to cancel")
-        else:
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the output's audio data is unchanged after writing, restoring it if not",
+    )
+    parser.add_argument(
+        "--io-jobs-per-device",
+        type=int,
+        help="number of files to write at once on each disk/mount (default: detected per device)",
+    )
+    parser.add_argument(
+        "--source",
+        dest="source_paths",
+        type=Path,
+        nargs="+",
+        help=(
+            "files/directories to search (recursively) for sources when inferring "
+            "(default: each output file's directory, not recursively)"
+        ),
+    )
+    parser.add_argument(
+        "--match-threshold",
+        type=float,
+        default=DEFAULT_MATCH_THRESHOLD,
+        help=(
+            "minimum score (0-1) for an inferred source to be used; "
+            "outputs without one are skipped"
+        ),
+    )
+    add_metrics_args(parser)
+    args = parser.parse_args(argv, namespace=ProgramArgsNamespace())
+    if args.input_file_paths is None:
+        targets = [MatchFeatures.from_file(path) for path in args.output_file_paths]
+        matches = infer_sources(
+            targets,
+            args.source_paths
+            or sorted({path.parent for path in args.output_file_paths}),
+            threshold=args.match_threshold,
+            # only given sources are searched below their top level
+            recursive=bool(args.source_paths),
+        )
+        pairs = [
+            (match.source.path, target.path)
+            for target, match in zip(targets, matches)
+            if match is not None
+        ]
+        if not pairs:
             raise ArgumentError(
                 input_file_arg, "Not provided and could not be inferred"
             )
+        args.input_file_paths = [input_path for input_path, _ in pairs]
+        args.output_file_paths = [output_path for _, output_path in pairs]
+    elif len(args.input_file_paths) not in {1, len(args.output_file_paths)}:
+        parser.error(
+            "the number of input files must be 1 or match the number of output files"
+        )
     return args
 
 
+class SourceTags:
+    """
+    a source file's tags, read once and translated at most once per target format; translated values
+    are shared between outputs, so they must not be modified in place
+    """
+
+    def __init__(
+        self,
+        input_file_path: Path,
+        translator: TagMapper | TranslationCache | None = None,
+    ):
+        with PHASE_SECONDS.time(phase="open"):
+            input_file = make_mutagen_file(input_file_path)
+        self.path = input_file_path
+        self.tag_format = get_tag_format(input_file)
+        self.album_key = get_album_key(input_file)
+        self.items = [
+            (k, v) for k, v in sorted(input_file.items()) if "replaygain" not in k
+        ]
+        # may be replaced before the first translation, e.g. with the album's TranslationCache
+        self.translator = translator or get_tag_mapper()
+        self._translations: dict[TagFormat, list[tuple[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _translate(self, target_format: TagFormat) -> list[tuple[str, Any]]:
+        translated = []
+        for k, v in self.items:
+            try:
+                with PHASE_SECONDS.time(phase="translate"):
+                    k_dest, v_dest, label = self.translator.translate_tag(
+                        k, v, self.tag_format, target_format
+                    )
+            except UnrecognisedTag:
+                LOGGER.info(f"Skipping tag {k!r}")
+                continue
+
+            if label == "COVER":
+                LOGGER.info(f"{label=}: output_file[{k_dest!r}]={v_dest.__class__!r}")
+            else:
+                LOGGER.info(f"{label=}: output_file[{k_dest!r}]={v_dest!r}")
+            translated.append((k_dest, v_dest))
+        return translated
+
+    def translate(self, target_format: TagFormat) -> list[tuple[str, Any]]:
+        # outputs are written in parallel; the first one of each format does the translating
+        with self._lock:
+            if target_format not in self._translations:
+                self._translations[target_format] = self._translate(target_format)
+            return self._translations[target_format]
+
+
+def write_metadata(
+    source_tags: SourceTags,
+    output_file_path: Path,
+    verify: bool = False,
+):
+    with PHASE_SECONDS.time(phase="open"):
+        output_file = make_mutagen_file(output_file_path)
+    LOGGER.info(f"Copying metadata: '{source_tags.path}' -> '{output_file_path}'")
+
+    for k_dest, v_dest in source_tags.translate(get_tag_format(output_file)):
+        output_file[k_dest] = v_dest
+
+    with PHASE_SECONDS.time(phase="save"):
+        if verify:
+            save_verified(output_file)
+        else:
+            output_file.save()
+
+
 def copy_metadata(
     input_file_path: Path,
     output_file_path: Path,
+    verify: bool = False,
+    translation_cache: TranslationCache | None = None,
 ):
-    input_file = make_mutagen_file(input_file_path)
-    output_file = make_mutagen_file(output_file_path)
-    LOGGER.info(f"Copying metadata: '{input_file_path}' -> '{output_file_path}'")
-
-    tag_mapper = TagMapper()
+    write_metadata(
+        SourceTags(input_file_path, translation_cache),
+        output_file_path,
+        verify=verify,
+    )
 
-    input_format = get_tag_format(input_file)
-    output_format = get_tag_format(output_file)
 
-    for k, v in sorted(input_file.items()):
-        if "replaygain" in k:
-            continue
-        try:
-            k_dest, v_dest, label = tag_mapper.translate_tag(
-                k, v, input_format, output_format
+def copy_metadata_fanout(
+    input_file_path: Path,
+    output_file_paths: list[Path],
+    verify: bool = False,
+    io_concurrency_per_device: int | None = None,
+):
+    """
+    copies metadata from one input to many outputs (e.g. copies of a track in different formats),
+    reading the input once and translating once per output tag format
+    """
+    source_tags = SourceTags(input_file_path)
+    run_jobs(
+        [
+            Job(
+                name=str(output_file_path),
+                io_func=partial(
+                    write_metadata, source_tags, output_file_path, verify=verify
+                ),
+                io_path=output_file_path,
             )
-        except UnrecognisedTag:
-            LOGGER.info(f"Skipping tag {k!r}")
-            continue
+            for output_file_path in output_file_paths
+        ],
+        io_concurrency_per_device=io_concurrency_per_device,
+    )
 
-        if label == "COVER":
-            LOGGER.info(f"{label=}: output_file[{k_dest!r}]={v_dest.__class__!r}")
-        else:
-            LOGGER.info(f"{label=}: output_file[{k_dest!r}]={v_dest!r}")
-        output_file[k_dest] = v_dest
 
-    output_file.save()
+def copy_metadata_batch(
+    input_output_paths: list[tuple[Path, Path]],
+    verify: bool = False,
+    io_concurrency_per_device: int | None = None,
+):
+    """
+    copies metadata for many (input, output) pairs; tracks of the same album share translated
+    values, so album-wide tags (album, artist, date, cover, ...) are only translated once per album
+    """
+    # built once up front, rather than by whichever worker threads get to it first
+    tag_mapper = get_tag_mapper()
+    translation_caches: dict[tuple[str, str] | None, TranslationCache] = {}
+    lock = threading.Lock()
+
+    def copy_pair(input_file_path: Path, output_file_path: Path):
+        # the input is only parsed once, here, for both its album and its tags
+        source_tags = SourceTags(input_file_path, tag_mapper)
+        with lock:
+            if source_tags.album_key not in translation_caches:
+                translation_caches[source_tags.album_key] = TranslationCache(tag_mapper)
+            source_tags.translator = translation_caches[source_tags.album_key]
+        write_metadata(source_tags, output_file_path, verify=verify)
+
+    jobs = [
+        Job(
+            name=str(output_file_path),
+            io_func=partial(copy_pair, input_file_path, output_file_path),
+            io_path=output_file_path,
+        )
+        for input_file_path, output_file_path in input_output_paths
+    ]
+    try:
+        run_jobs(jobs, io_concurrency_per_device=io_concurrency_per_device)
+    finally:
+        hits = sum(cache.hits for cache in translation_caches.values())
+        misses = sum(cache.misses for cache in translation_caches.values())
+        LOGGER.info(
+            f"Translated {misses} distinct tag value(s) for {hits + misses} tag(s) "
+            f"across {len(translation_caches)} album(s)"
+        )
 
 
 def main(args: ProgramArgsNamespace) -> None:
-    copy_metadata(args.input_file_path, args.output_file_path)
+    with MetricsExporter.from_args(args):
+        if len(args.output_file_paths) == 1:
+            copy_metadata(
+                args.input_file_paths[0], args.output_file_paths[0], verify=args.verify
+            )
+            return
+        if len(args.input_file_paths) == 1:
+            copy_metadata_fanout(
+                args.input_file_paths[0],
+                args.output_file_paths,
+                verify=args.verify,
+                io_concurrency_per_device=args.io_jobs_per_device,
+            )
+            return
+        copy_metadata_batch(
+            list(zip(args.input_file_paths, args.output_file_paths)),
+            verify=args.verify,
+            io_concurrency_per_device=args.io_jobs_per_device,
+        )
 
 
 if __name__ == "__main__":
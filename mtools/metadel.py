@@ -5,6 +5,7 @@ from pathlib import Path
 from utils_python import setup_logger
 
 from mtools.metaview import view_file
+from mtools.payload import save_verified
 from mtools.utils import make_mutagen_file
 
 LOGGER = logging.getLogger(__name__)
@@ -13,9 +14,10 @@ LOGGER = logging.getLogger(__name__)
 class ProgramArgsNamespace(Namespace):
     input_file_path: Path
     tag_to_delete: str | None
+    verify: bool
 
 
-def get_args() -> ProgramArgsNamespace:
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
     parser = ArgumentParser()
     parser.add_argument(
         "input_file_path",
@@ -27,7 +29,12 @@ def get_args() -> ProgramArgsNamespace:
         "-t",
         "--tag-to-delete",
     )
-    return parser.parse_args(namespace=ProgramArgsNamespace())
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the audio data is unchanged after writing, restoring the file if not",
+    )
+    return parser.parse_args(argv, namespace=ProgramArgsNamespace())
 
 
 def main(args: ProgramArgsNamespace) -> None:
@@ -40,7 +47,10 @@ def main(args: ProgramArgsNamespace) -> None:
             f"deleting {args.tag_to_delete!r} (was {input_file[args.tag_to_delete]!r})"
         )
         del input_file[args.tag_to_delete]
-        input_file.save()
+        if args.verify:
+            save_verified(input_file)
+        else:
+            input_file.save()
     else:
         view_file(input_file, raw=True)
 
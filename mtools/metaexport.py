@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+
+from utils_python import setup_logger
+
+from mtools.batch import PENDING_PER_WORKER, map_bounded
+from mtools.errors import UnrecognisedValue
+from mtools.manifest import CoverStore, make_header, value_to_json
+from mtools.tag_mapper import get_tag_format
+from mtools.utils import make_mutagen_file
+from mtools.walk import WalkFilter, add_walk_args, iter_audio_files
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ProgramArgsNamespace(Namespace):
+    root: Path
+    manifest_path: Path | None
+    covers_dir: Path | None
+    jobs: int
+    min_size: int | None
+    max_size: int | None
+    modified_after: float | None
+    modified_before: float | None
+
+
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
+    parser = ArgumentParser(
+        description="export the tags of all files under a directory to a JSON Lines manifest"
+    )
+    parser.add_argument(
+        "root",
+        metavar="DIR",
+        type=Path,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="manifest_path",
+        type=Path,
+        help="manifest file to write (default: stdout)",
+    )
+    parser.add_argument(
+        "--covers-dir",
+        type=Path,
+        help=(
+            "where to store cover images, once per distinct image "
+            "(default: next to the manifest, or ./covers)"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    add_walk_args(parser)
+    args = parser.parse_args(argv, namespace=ProgramArgsNamespace())
+    if args.covers_dir is None:
+        args.covers_dir = get_default_covers_dir(args.manifest_path)
+    return args
+
+
+def get_default_covers_dir(manifest_path: Path | None) -> Path:
+    if manifest_path is None:
+        return Path("covers")
+    return manifest_path.with_name(f"{manifest_path.stem}.covers")
+
+
+def export_file(path: Path, root: Path, cover_store: CoverStore) -> dict | None:
+    try:
+        file = make_mutagen_file(path)
+        tag_format = get_tag_format(file)
+    except Exception:  # pylint: disable=broad-exception-caught
+        LOGGER.exception(f"Skipping unreadable file '{path}'")
+        return None
+    tags = {}
+    for key, value in sorted(file.items()):
+        try:
+            tags[key] = value_to_json(key, value, tag_format, cover_store.put)
+        except UnrecognisedValue:
+            LOGGER.info(f"Skipping tag {key!r} of '{path}'")
+    return {
+        "path": path.relative_to(root).as_posix(),
+        "format": str(tag_format),
+        "tags": tags,
+    }
+
+
+def main(args: ProgramArgsNamespace) -> None:
+    cover_store = CoverStore(args.covers_dir)
+    paths = iter_audio_files([args.root], WalkFilter.from_args(args))
+    count = 0
+    with (
+        (
+            open(args.manifest_path, "w", encoding="utf-8")
+            if args.manifest_path
+            else nullcontext(sys.stdout)
+        ) as output,
+        ProcessPoolExecutor(max_workers=args.jobs) as executor,
+    ):
+        # so metaimport finds the covers wherever they were written
+        header = make_header(args.covers_dir, args.manifest_path)
+        output.write(json.dumps(header, ensure_ascii=False) + "\n")
+        # results come in walk order as they arrive, so the manifest is written as it goes
+        for record in map_bounded(
+            executor,
+            partial(export_file, root=args.root, cover_store=cover_store),
+            paths,
+            max_pending=args.jobs * PENDING_PER_WORKER,
+        ):
+            if record is None:
+                continue
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    LOGGER.info(f"Exported {count} file(s); covers in '{args.covers_dir}'")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    setup_logger()
+    main(args)
@@ -0,0 +1,204 @@
+import json
+import logging
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from functools import partial
+from pathlib import Path
+
+from utils_python import setup_logger
+
+from mtools.batch import map_bounded_per_device
+from mtools.errors import UnrecognisedTag, UnrecognisedValue
+from mtools.manifest import (
+    CoverStore,
+    get_header_covers_dir,
+    is_header,
+    value_from_json,
+    value_to_json,
+)
+from mtools.metaexport import get_default_covers_dir
+from mtools.tag_mapper import TagFormat, get_tag_format, get_tag_mapper
+from mtools.utils import make_mutagen_file
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ProgramArgsNamespace(Namespace):
+    manifest_path: Path
+    root: Path
+    covers_dir: Path | None
+    dry_run: bool
+    io_jobs_per_device: int | None
+
+
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
+    parser = ArgumentParser(
+        description="apply a (possibly edited) JSON Lines manifest from metaexport back to files"
+    )
+    parser.add_argument(
+        "manifest_path",
+        metavar="MANIFEST",
+        type=Path,
+    )
+    parser.add_argument(
+        "-r",
+        "--root",
+        type=Path,
+        default=Path("."),
+        help="directory the manifest's paths are relative to (default: current directory)",
+    )
+    parser.add_argument(
+        "--covers-dir",
+        type=Path,
+        help=(
+            "where the manifest's cover images are stored "
+            "(default: as recorded in the manifest, else next to it, else ./covers)"
+        ),
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="report which files would change without writing them",
+    )
+    parser.add_argument(
+        "--io-jobs-per-device",
+        type=int,
+        help="number of files to update at once on each disk/mount (default: detected per device)",
+    )
+    args = parser.parse_args(argv, namespace=ProgramArgsNamespace())
+    if args.covers_dir is None:
+        args.covers_dir = get_covers_dir(args.manifest_path)
+    return args
+
+
+def get_covers_dir(manifest_path: Path) -> Path:
+    """
+    gets the covers directory recorded in the manifest's header; manifests without one had their
+    covers stored next to them, or in ./covers if exported to stdout
+    """
+    for record in iter_records(manifest_path, headers=True):
+        if is_header(record):
+            return get_header_covers_dir(record, manifest_path)
+        break
+    covers_dir = get_default_covers_dir(manifest_path)
+    return covers_dir if covers_dir.is_dir() else get_default_covers_dir(None)
+
+
+def get_current_tags(file, tag_format: TagFormat) -> dict:
+    current = {}
+    for key, value in file.items():
+        try:
+            current[key] = value_to_json(key, value, tag_format)
+        except UnrecognisedValue:
+            continue
+    return current
+
+
+def import_record(
+    record: dict,
+    root: Path,
+    cover_store: CoverStore,
+    dry_run: bool = False,
+) -> str:
+    """
+    applies one manifest record to its file, writing only if its tags would change; returns the
+    outcome
+
+    a record in the file's own format replaces all of its (exportable) tags, so tags removed from
+    the manifest are deleted; a record in another format only sets the tags it translates to
+    """
+    path = root / record["path"]
+    file = make_mutagen_file(path)
+    source_format = TagFormat(record["format"])
+    target_format = get_tag_format(file)
+    tag_mapper = get_tag_mapper()
+
+    desired = {}
+    for key, json_value in record["tags"].items():
+        try:
+            value = value_from_json(key, json_value, source_format, cover_store)
+            if source_format != target_format:
+                key, value, _ = tag_mapper.translate_tag(
+                    key, value, source_format, target_format
+                )
+        except (UnrecognisedTag, UnrecognisedValue):
+            LOGGER.info(f"Skipping tag {key!r} for '{path}'")
+            continue
+        desired[key] = value
+
+    current = get_current_tags(file, target_format)
+    to_set = {}
+    for key, value in desired.items():
+        try:
+            if current.get(key) == value_to_json(key, value, target_format):
+                continue
+        except UnrecognisedValue:
+            # can't be compared, so it's written regardless
+            pass
+        to_set[key] = value
+    to_delete = (
+        [key for key in current if key not in desired]
+        if source_format == target_format
+        else []
+    )
+    if not to_set and not to_delete:
+        return "unchanged"
+    if dry_run:
+        LOGGER.info(
+            f"Would update '{path}': set {sorted(to_set)}, delete {sorted(to_delete)}"
+        )
+        return "changed"
+
+    for key, value in to_set.items():
+        file[key] = value
+    for key in to_delete:
+        del file[key]
+    file.save()
+    LOGGER.info(f"Updated '{path}': set {sorted(to_set)}, delete {sorted(to_delete)}")
+    return "changed"
+
+
+def _try_import_record(record: dict, **kwargs) -> str:
+    try:
+        return import_record(record, **kwargs)
+    except Exception:  # pylint: disable=broad-exception-caught
+        LOGGER.exception(f"Failed to import '{record.get('path')}'")
+        return "failed"
+
+
+def iter_records(manifest_path: Path, headers: bool = False):
+    with open(manifest_path, encoding="utf-8") as manifest:
+        for line in manifest:
+            if line.strip():
+                record = json.loads(line)
+                if headers or not is_header(record):
+                    yield record
+
+
+def main(args: ProgramArgsNamespace) -> None:
+    cover_store = CoverStore(args.covers_dir)
+    outcomes = Counter()
+    # built once up front, rather than by whichever worker threads get to it first
+    get_tag_mapper()
+    for outcome in map_bounded_per_device(
+        partial(
+            _try_import_record,
+            root=args.root,
+            cover_store=cover_store,
+            dry_run=args.dry_run,
+        ),
+        iter_records(args.manifest_path),
+        get_path=lambda record: args.root / record["path"],
+        concurrency_per_device=args.io_jobs_per_device,
+    ):
+        outcomes[outcome] += 1
+    print(
+        ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+    )
+
+
+if __name__ == "__main__":
+    args = get_args()
+    setup_logger()
+    main(args)
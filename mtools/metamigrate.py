@@ -0,0 +1,193 @@
+import json
+import logging
+import sys
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+
+from utils_python import setup_logger
+
+from mtools.batch import map_bounded_per_device
+from mtools.errors import UnrecognisedTag, UnrecognisedValue
+from mtools.tag_mapper import TagFormat, get_tag_mapper
+from mtools.utils import make_mutagen_file
+from mtools.walk import WalkFilter, add_walk_args, iter_audio_files
+
+LOGGER = logging.getLogger(__name__)
+
+_ID3_MAJOR_VERSIONS = {TagFormat.ID3v2_3: 3, TagFormat.ID3v2_4: 4}
+
+# frames mutagen converts itself when changing version (e.g. TDRC <-> TYER/TDAT/TIME);
+# the mappings would copy a full timestamp into a year-only frame
+_NATIVELY_CONVERTED_FRAMES = {"TDRC", "TDOR", "TIPL", "TMCL"}
+
+
+class ProgramArgsNamespace(Namespace):
+    paths: list[Path]
+    target_format: TagFormat
+    report_path: Path | None
+    dry_run: bool
+    io_jobs_per_device: int | None
+    min_size: int | None
+    max_size: int | None
+    modified_after: float | None
+    modified_before: float | None
+
+
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
+    parser = ArgumentParser(
+        description="rewrite the ID3 tags of MP3 files to another ID3v2 version, in place"
+    )
+    parser.add_argument(
+        "paths",
+        metavar="PATH",
+        type=Path,
+        nargs="+",
+        help="MP3 files, or directories to search for them",
+    )
+    parser.add_argument(
+        "--to",
+        dest="target_format",
+        choices=["2.3", "2.4"],
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--report",
+        dest="report_path",
+        type=Path,
+        help="JSON Lines report of what was done to each file (default: stdout)",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="report what would change without writing any files",
+    )
+    parser.add_argument(
+        "--io-jobs-per-device",
+        type=int,
+        help="number of files to rewrite at once on each disk/mount (default: detected per device)",
+    )
+    add_walk_args(parser)
+    args = parser.parse_args(argv, namespace=ProgramArgsNamespace())
+    args.target_format = TagFormat(f"ID3v{args.target_format}")
+    return args
+
+
+def read_id3_major_version(path: Path) -> int | None:
+    """
+    reads just the ID3v2 header; None if the file doesn't start with an ID3v2 tag
+    """
+    with open(path, "rb") as f:
+        header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return None
+    return header[3]
+
+
+def remap_frames(tags, target_format: TagFormat) -> dict[str, str]:
+    """
+    renames frames whose mapping differs between ID3 versions (e.g. TMOO <-> TXXX:MOOD);
+    returns {old key: new key}
+    """
+    tag_mapper = get_tag_mapper()
+    source_format = (
+        TagFormat.ID3v2_4 if target_format == TagFormat.ID3v2_3 else TagFormat.ID3v2_3
+    )
+    renamed = {}
+    for key in sorted(tags.keys()):
+        if key in _NATIVELY_CONVERTED_FRAMES:
+            continue
+        try:
+            target_key, target_value, _ = tag_mapper.translate_tag(
+                key, tags[key], source_format, target_format
+            )
+        except (UnrecognisedTag, UnrecognisedValue):
+            continue
+        if target_key == key:
+            continue
+        if target_key in tags:
+            LOGGER.info(f"Not replacing existing {target_key!r} with {key!r}")
+            continue
+        del tags[key]
+        tags[target_key] = target_value
+        renamed[key] = target_key
+    return renamed
+
+
+def migrate_file(path: Path, target_format: TagFormat, dry_run: bool = False) -> dict:
+    target_version = _ID3_MAJOR_VERSIONS[target_format]
+    record = {"path": str(path), "from": None, "to": f"2.{target_version}"}
+    try:
+        version = read_id3_major_version(path)
+        record["from"] = None if version is None else f"2.{version}"
+        if version is None:
+            return {**record, "status": "skipped", "reason": "no ID3v2 tag"}
+        if version == target_version:
+            return {**record, "status": "skipped", "reason": "already at target"}
+
+        file = make_mutagen_file(path)
+        tags = file.tags
+        renamed = remap_frames(tags, target_format)
+        if target_format == TagFormat.ID3v2_3:
+            # mapped frames that are valid in both versions (e.g. TSOP) would otherwise be
+            # dropped as v2.4-only frames
+            v23_keys = get_tag_mapper().mappings_by_format[TagFormat.ID3v2_3]
+            kept = [
+                tags[key]
+                for key in tags.keys()
+                if key in v23_keys and key not in _NATIVELY_CONVERTED_FRAMES
+            ]
+            tags.update_to_v23()
+            for frame in kept:
+                if frame.HashKey not in tags:
+                    tags.add(frame)
+        if not dry_run:
+            file.save(v2_version=target_version)
+        return {**record, "status": "migrated", "renamed": renamed}
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        LOGGER.exception(f"Failed to migrate '{path}'")
+        return {**record, "status": "failed", "reason": repr(exc)}
+
+
+def main(args: ProgramArgsNamespace) -> None:
+    paths = (
+        path
+        for path in iter_audio_files(
+            args.paths, WalkFilter.from_args(args, suffixes={".mp3"})
+        )
+        if path.suffix == ".mp3"
+    )
+    outcomes = Counter()
+    # built once up front, rather than by whichever worker threads get to it first
+    get_tag_mapper()
+    with (
+        open(args.report_path, "w", encoding="utf-8")
+        if args.report_path
+        else nullcontext(sys.stdout)
+    ) as output:
+        for record in map_bounded_per_device(
+            partial(
+                migrate_file,
+                target_format=args.target_format,
+                dry_run=args.dry_run,
+            ),
+            paths,
+            get_path=lambda path: path,
+            concurrency_per_device=args.io_jobs_per_device,
+        ):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            outcomes[record["status"]] += 1
+    LOGGER.info(
+        f"{'Would migrate' if args.dry_run else 'Migrated'} {outcomes['migrated']} file(s) "
+        f"to {args.target_format}; {outcomes['skipped']} skipped, {outcomes['failed']} failed"
+    )
+
+
+if __name__ == "__main__":
+    args = get_args()
+    setup_logger()
+    main(args)
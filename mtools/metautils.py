@@ -1,7 +1,8 @@
-import importlib
 import re
+from functools import cache
 from typing import cast
 
+from mutagen.id3 import Frames
 from mutagen.id3._frames import APIC, PRIV
 from mutagen.mp4 import AtomDataType, MP4FreeForm, MP4Tags
 
@@ -48,6 +49,7 @@ class MP4Key(Key):
         self.label = self.label_from_mp4tags_docstring(self.raw)
 
     @staticmethod
+    @cache
     def label_from_mp4tags_docstring(key: str):
         pattern = rf"\s*\* '{''.join(f'\\\\\\\\x{ord(c):02x}' if ord(c) > 127 else c for c in key)}' -- ([\w /]+)"
         m = re.search(pattern, MP4Tags.__doc__)
@@ -81,9 +83,6 @@ def format_m4a_values(values):
     return [format_m4a_value(value) for value in values]
 
 
-_ID3_FRAMES_MODULE = importlib.import_module("mutagen.id3._frames")
-
-
 class MP3Key(Key):
     def __init__(self, raw_key: str):
         super().__init__(raw_key)
@@ -114,7 +113,7 @@ class MP3Key(Key):
                 self.label = self.label_from_frame_docstring(cmp_key)
                 return
 
-        if cls := getattr(_ID3_FRAMES_MODULE, self.raw.split(":")[0]):
+        if cls := Frames.get(self.raw.split(":")[0]):
             self.key_display = cls.__name__
             self.label = cls.__doc__.split("\n")[0].strip(".")
             return
@@ -1,4 +1,5 @@
 from argparse import ArgumentParser, Namespace
+from collections.abc import Collection
 from datetime import timedelta
 from pathlib import Path
 
@@ -7,23 +8,32 @@ from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4
 
 from mtools.errors import UnrecognisedFormat
-from mtools.metautils import MP3Key, MP4Key, format_m4a_values, format_mp3_value
+from mtools.metautils import (
+    Key,
+    MP3Key,
+    MP4Key,
+    format_m4a_values,
+    format_mp3_value,
+)
 from mtools.utils import make_mutagen_file
 
 
 class ProgramArgsNamespace(Namespace):
-    path: Path
+    paths: list[Path]
     show_skipped: bool
     include_replaygain: bool
     raw: bool
+    keys: list[str] | None
+    labels: list[str] | None
 
 
-def get_args() -> ProgramArgsNamespace:
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
     parser = ArgumentParser()
     parser.add_argument(
-        "path",
+        "paths",
         metavar="PATH",
         type=Path,
+        nargs="+",
     )
     parser.add_argument(
         "--include-replaygain",
@@ -39,17 +49,66 @@ def get_args() -> ProgramArgsNamespace:
         "--raw",
         action="store_true",
     )
-    return parser.parse_args(namespace=ProgramArgsNamespace())
+    parser.add_argument(
+        "-k",
+        "--keys",
+        nargs="+",
+        help="only show these tag keys, raw (e.g. 'TXXX:BARCODE') or displayed (e.g. 'TXXX')",
+    )
+    parser.add_argument(
+        "-l",
+        "--labels",
+        nargs="+",
+        help=(
+            "only show tags with these labels (case-insensitive, e.g. 'album'); "
+            "'length' selects the length line"
+        ),
+    )
+    return parser.parse_args(argv, namespace=ProgramArgsNamespace())
+
+
+def select_keys(
+    file: FileType,
+    key_class: type[Key],
+    keys: Collection[str] | None = None,
+    labels: Collection[str] | None = None,
+) -> list[Key]:
+    """
+    filters tags by key string before building Key objects, then by label; values are not touched
+    """
+    raw_keys = sorted(file.keys())
+    if keys:
+        raw_keys = [k for k in raw_keys if k in keys or k.split(":")[0] in keys]
+    selected = [key_class(k) for k in raw_keys]
+    if labels:
+        labels = {label.casefold() for label in labels}
+        selected = [
+            key
+            for key in selected
+            if key.label is not None and key.label.casefold() in labels
+        ]
+    return selected
+
+
+def should_show_length(
+    keys: Collection[str] | None = None,
+    labels: Collection[str] | None = None,
+):
+    if not keys and not labels:
+        return True
+    return any(label.casefold() == "length" for label in labels or [])
 
 
 def view_m4a(
     file: MP4,
     raw: bool = False,
+    keys: Collection[str] | None = None,
+    labels: Collection[str] | None = None,
 ):
-    print(f"[    ] length: {timedelta(seconds=round(file.info.length))}")
-    keys_values = [(MP4Key(key_str), value) for key_str, value in file.items()]
-    keys_values = sorted(keys_values, key=lambda kv: kv[0].raw)
-    for key, values in keys_values:
+    if should_show_length(keys, labels):
+        print(f"[    ] length: {timedelta(seconds=round(file.info.length))}")
+    for key in select_keys(file, MP4Key, keys, labels):
+        values = file[key.raw]
         if key.raw == "covr" or not raw:
             values_shown = format_m4a_values(values)
         else:
@@ -72,15 +131,17 @@ def view_mp3(
     raw: bool = False,
     include_replaygain: bool = False,
     show_skipped: bool = False,
+    keys: Collection[str] | None = None,
+    labels: Collection[str] | None = None,
 ):
-    print(f"[    ] length: {timedelta(seconds=round(file.info.length))}")
-    keys_values = [(MP3Key(key_str), value) for key_str, value in file.items()]
-    keys_values = sorted(keys_values, key=lambda kv: kv[0].raw)
-    for key, value in keys_values:
+    if should_show_length(keys, labels):
+        print(f"[    ] length: {timedelta(seconds=round(file.info.length))}")
+    for key in select_keys(file, MP3Key, keys, labels):
         if not key.is_known and not show_skipped:
             continue
         if "replaygain" in key.raw and not include_replaygain and not show_skipped:
             continue
+        value = file[key.raw]
         if key.is_known:
             if raw:
                 if key.raw == "APIC:":
@@ -98,6 +159,8 @@ def view_file(
     raw: bool = False,
     show_skipped: bool = False,
     include_replaygain: bool = False,
+    keys: Collection[str] | None = None,
+    labels: Collection[str] | None = None,
 ):
     match file:
         case MP3():
@@ -106,24 +169,33 @@ def view_file(
                 raw=raw,
                 include_replaygain=include_replaygain,
                 show_skipped=show_skipped,
+                keys=keys,
+                labels=labels,
             )
         case MP4():
             view_m4a(
                 file,
                 raw=raw,
+                keys=keys,
+                labels=labels,
             )
         case _:
             raise UnrecognisedFormat(f"Unrecognised file type {file.__class__}")
 
 
 def main(args: ProgramArgsNamespace) -> None:
-    file = make_mutagen_file(args.path)
-    view_file(
-        file,
-        raw=args.raw,
-        show_skipped=args.show_skipped,
-        include_replaygain=args.include_replaygain,
-    )
+    for path in args.paths:
+        if len(args.paths) > 1:
+            print(f"==> {path} <==")
+        file = make_mutagen_file(path)
+        view_file(
+            file,
+            raw=args.raw,
+            show_skipped=args.show_skipped,
+            include_replaygain=args.include_replaygain,
+            keys=args.keys,
+            labels=args.labels,
+        )
 
 
 if __name__ == "__main__":
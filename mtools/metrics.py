@@ -0,0 +1,353 @@
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds between rewrites of the metrics textfile
+DEFAULT_EXPORT_INTERVAL = 10.0
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = (
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(labelnames, labelvalues)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _get_labelvalues(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._render_samples(),
+        ]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._get_labelvalues(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._get_labelvalues(labels), 0)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._get_labelvalues(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        *args,
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.buckets = (*sorted(buckets), math.inf)
+        # labelvalues -> (per-bucket counts, sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._get_labelvalues(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str):
+        """
+        observes the time taken by the with block, in seconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(
+                    (*self.labelnames, "le"), (*key, _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        renders all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(line + "\n" for metric in metrics for line in metric.render())
+
+
+REGISTRY = MetricsRegistry()
+
+JOBS_QUEUED = REGISTRY.register(
+    Gauge("mtools_jobs_queued", "Job stages waiting for a worker", ("stage",))
+)
+JOBS_RUNNING = REGISTRY.register(
+    Gauge("mtools_jobs_running", "Job stages currently running", ("stage",))
+)
+JOBS_FINISHED = REGISTRY.register(
+    Counter("mtools_jobs_total", "Jobs finished, by outcome", ("outcome",))
+)
+PHASE_SECONDS = REGISTRY.register(
+    Histogram(
+        "mtools_phase_duration_seconds",
+        "Time spent in each phase of processing a file",
+        ("phase",),
+    )
+)
+ENCODE_SPEED = REGISTRY.register(
+    Histogram(
+        "mtools_encode_speed_ratio",
+        "ffmpeg encode speed, as a multiple of realtime",
+        buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    )
+)
+BYTES_READ = REGISTRY.register(
+    Counter("mtools_read_bytes_total", "Bytes of audio files read")
+)
+BYTES_WRITTEN = REGISTRY.register(
+    Counter("mtools_written_bytes_total", "Bytes of audio files written")
+)
+CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "mtools_cache_lookups_total",
+        "Cache lookups, by cache and result (hit/miss)",
+        ("cache", "result"),
+    )
+)
+
+
+def write_textfile(path: Path, registry: MetricsRegistry = REGISTRY):
+    """
+    writes the metrics atomically, as the node_exporter textfile collector may read at any time
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(registry.render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class MetricsExporter:
+    """
+    exports metrics while a batch runs: rewrites a textfile periodically and/or serves them over
+    HTTP
+    """
+
+    def __init__(
+        self,
+        textfile_path: Path | None = None,
+        port: int | None = None,
+        interval: float = DEFAULT_EXPORT_INTERVAL,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        self.textfile_path = textfile_path
+        self.port = port
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._server = None
+
+    @classmethod
+    def from_args(cls, args: Namespace):
+        return cls(textfile_path=args.metrics_file, port=args.metrics_port)
+
+    def _write_periodically(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                write_textfile(self.textfile_path, self.registry)
+            except OSError:
+                LOGGER.exception(f"Failed to write metrics to '{self.textfile_path}'")
+
+    def _make_handler(self):
+        # only needed with --metrics-port, so not imported with every command
+        # pylint: disable-next=import-outside-toplevel
+        from http.server import BaseHTTPRequestHandler
+
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                LOGGER.debug(format % args)
+
+        return MetricsHandler
+
+    def start(self):
+        if self.textfile_path is not None:
+            write_textfile(self.textfile_path, self.registry)
+            self._threads.append(
+                threading.Thread(target=self._write_periodically, daemon=True)
+            )
+        if self.port is not None:
+            from http.server import (  # pylint: disable=import-outside-toplevel
+                ThreadingHTTPServer,
+            )
+
+            # local only; there's no authentication
+            self._server = ThreadingHTTPServer(
+                ("127.0.0.1", self.port), self._make_handler()
+            )
+            LOGGER.info(f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+            self._threads.append(
+                threading.Thread(target=self._server.serve_forever, daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        if self.textfile_path is not None:
+            # so the final state of the run is kept
+            write_textfile(self.textfile_path, self.registry)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def add_metrics_args(parser: ArgumentParser):
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help=(
+            "keep a Prometheus textfile of progress/performance metrics updated here "
+            "while running"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this port (localhost only) while running",
+    )
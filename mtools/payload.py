@@ -0,0 +1,112 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+
+from mutagen._file import FileType
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, Atoms
+from utils_python import PathInput
+
+from mtools.errors import PayloadMismatch, UnrecognisedFormat
+from mtools.utils import make_mutagen_file
+
+_HASH_CHUNK_SIZE = 1 << 20
+_ID3V1_SIZE = 128
+# APEv2 tags end with a footer, and may start with a header of the same size
+_APE_FOOTER_SIZE = 32
+_APE_HAS_HEADER = 1 << 31
+
+
+def _get_trailing_tag_size(fileobj, start: int, end: int) -> int:
+    """
+    gets the size of an ID3v1 or APEv2 tag that ends at `end`; 0 if there isn't one
+    """
+    if end - start >= _ID3V1_SIZE:
+        fileobj.seek(end - _ID3V1_SIZE)
+        if fileobj.read(3) == b"TAG":
+            return _ID3V1_SIZE
+    if end - start >= _APE_FOOTER_SIZE:
+        fileobj.seek(end - _APE_FOOTER_SIZE)
+        footer = fileobj.read(_APE_FOOTER_SIZE)
+        if footer[:8] == b"APETAGEX":
+            # the size counts the items and footer, but not the header
+            size, _, flags = struct.unpack("<III", footer[12:24])
+            if flags & _APE_HAS_HEADER:
+                size += _APE_FOOTER_SIZE
+            return min(size, end - start)
+    return 0
+
+
+def get_audio_payload_ranges(file: FileType) -> list[tuple[int, int]]:
+    """
+    gets (offset, length) of the regions of an opened file that hold audio rather than tags
+    """
+    file_size = os.path.getsize(file.filename)
+    match file:
+        case MP3():
+            start = file.tags.size if file.tags is not None else 0
+            end = file_size
+            with open(file.filename, "rb") as fileobj:
+                # ID3v1 and APEv2 tags, in either order
+                while tag_size := _get_trailing_tag_size(fileobj, start, end):
+                    end -= tag_size
+            return [(start, end - start)]
+        case MP4():
+            with open(file.filename, "rb") as fileobj:
+                atoms = Atoms(fileobj)
+            return [
+                (atom._dataoffset, atom.datalength)  # pylint: disable=protected-access
+                for atom in atoms.atoms
+                if atom.name == b"mdat"
+            ]
+        case _:
+            raise UnrecognisedFormat(f"Unrecognised file type {file.__class__}")
+
+
+def hash_ranges(path: PathInput, ranges: list[tuple[int, int]]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fileobj:
+        if os.fstat(fileobj.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset, length in ranges:
+                    for chunk_start in range(offset, offset + length, _HASH_CHUNK_SIZE):
+                        chunk_end = min(chunk_start + _HASH_CHUNK_SIZE, offset + length)
+                        digest.update(view[chunk_start:chunk_end])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def hash_audio_payload(path: PathInput) -> str:
+    path = Path(path)
+    return hash_ranges(path, get_audio_payload_ranges(make_mutagen_file(path)))
+
+
+def save_verified(file: FileType) -> None:
+    """
+    saves a file's tags, restoring the original file if the audio payload hash changed
+    """
+    path = Path(file.filename)
+    payload_hash = hash_ranges(path, get_audio_payload_ranges(file))
+    fd, backup_path = tempfile.mkstemp(
+        prefix=f".{path.name}.", suffix=".bak", dir=path.parent
+    )
+    os.close(fd)
+    shutil.copy2(path, backup_path)
+    try:
+        file.save()
+        if hash_audio_payload(path) != payload_hash:
+            raise PayloadMismatch(
+                f"Audio payload of '{path}' changed on save; restored original"
+            )
+    except BaseException:
+        os.replace(backup_path, path)
+        raise
+    os.unlink(backup_path)
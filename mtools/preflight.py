@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from pathlib import Path
+
+from utils_python import PathInput
+
+from mtools.utils import get_cache_dir
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class ProbeResult:
+    path: str
+    format_name: str | None
+    codec: str | None
+    duration: float
+    channels: int | None
+    sample_rate: int | None
+    tags: dict[str, str] = field(default_factory=dict)
+    has_cover: bool = False
+
+    @classmethod
+    def from_probe(cls, path: Path, probe: dict):
+        format_info = probe.get("format", {})
+        audio_stream = None
+        has_cover = False
+        for stream in probe.get("streams", []):
+            if stream.get("codec_type") == "audio" and audio_stream is None:
+                audio_stream = stream
+            elif stream.get("disposition", {}).get("attached_pic"):
+                has_cover = True
+        audio_stream = audio_stream or {}
+        duration = audio_stream.get("duration") or format_info.get("duration") or 0
+        return cls(
+            path=str(path),
+            format_name=format_info.get("format_name"),
+            codec=audio_stream.get("codec_name"),
+            duration=float(duration),
+            channels=audio_stream.get("channels"),
+            sample_rate=(
+                int(audio_stream["sample_rate"])
+                if "sample_rate" in audio_stream
+                else None
+            ),
+            tags={k.lower(): v for k, v in format_info.get("tags", {}).items()},
+            has_cover=has_cover,
+        )
+
+    @property
+    def is_aac(self):
+        return self.codec == "aac"
+
+
+class ProbeCache:
+    """
+    ffprobe results, keyed by resolved path and invalidated when the file's size or mtime changes
+    """
+
+    def __init__(self, cache_path: PathInput | None = None):
+        self._cache_path = (
+            Path(cache_path) if cache_path else get_cache_dir() / "probe_cache.json"
+        )
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+        self._dirty = False
+        if self._cache_path.exists():
+            try:
+                self._entries = json.loads(self._cache_path.read_text("utf-8"))
+            except ValueError:
+                LOGGER.warning(f"Ignoring unreadable probe cache {self._cache_path}")
+
+    @staticmethod
+    def _fingerprint(path: Path):
+        stat = path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path: Path) -> ProbeResult | None:
+        with self._lock:
+            entry = self._entries.get(str(path.resolve()))
+        if entry is None or entry["fingerprint"] != self._fingerprint(path):
+            return None
+        return ProbeResult(**entry["result"])
+
+    def put(self, path: Path, result: ProbeResult):
+        entry = {"fingerprint": self._fingerprint(path), "result": asdict(result)}
+        with self._lock:
+            self._entries[str(path.resolve())] = entry
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._cache_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._entries), "utf-8")
+            tmp_path.replace(self._cache_path)
+            self._dirty = False
+
+
+def probe_file(path: PathInput, cache: ProbeCache | None = None) -> ProbeResult:
+    path = Path(path)
+    if cache is not None and (result := cache.get(path)) is not None:
+        return result
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    result = ProbeResult.from_probe(path, ffmpeg.probe(str(path)))
+    if cache is not None:
+        cache.put(path, result)
+    return result
+
+
+def preflight(
+    paths: list[Path],
+    cache: ProbeCache | None = None,
+    max_workers: int | None = None,
+) -> list[ProbeResult]:
+    """
+    probes all paths in parallel (ffprobe runs out-of-process, so threads suffice)
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda path: probe_file(path, cache), paths))
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def print_preflight_report(results: list[ProbeResult], force_encode: bool = False):
+    total_duration = sum(result.duration for result in results)
+    to_encode = [result for result in results if force_encode or not result.is_aac]
+    encode_duration = sum(result.duration for result in to_encode)
+    longest = max(results, key=lambda result: result.duration, default=None)
+    print(
+        f"Preflight: {len(results)} file(s), "
+        f"{timedelta(seconds=round(total_duration))} of audio"
+    )
+    print(
+        f"  {len(to_encode)} to encode ({timedelta(seconds=round(encode_duration))}), "
+        f"{len(results) - len(to_encode)} to remux"
+    )
+    if longest is not None:
+        print(
+            f"  longest: '{longest.path}' "
+            f"({timedelta(seconds=round(longest.duration))})"
+        )
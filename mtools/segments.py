@@ -0,0 +1,304 @@
+import logging
+import math
+import tempfile
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+from mtools.errors import SegmentMismatch
+from mtools.preflight import ProbeResult
+
+LOGGER = logging.getLogger(__name__)
+
+# samples per AAC (LC) frame; segment boundaries fall on frame boundaries so they can be cut
+# losslessly
+AAC_FRAME_SAMPLES = 1024
+# ffmpeg's AAC encoder starts every encode with one frame of priming, so its frame i completes input
+# frame i - 1 (and the frame before that is needed to decode it)
+ENCODER_DELAY_FRAMES = 1
+DEFAULT_SEGMENT_DURATION = 300.0
+# frames encoded before and after each boundary and dropped when joining, so the encoder's rate
+# control has settled by the boundary (about 1.5s at 44.1kHz)
+BOUNDARY_OVERLAP_FRAMES = 64
+# seconds of audio, either side of a boundary, compared against the input when verifying
+_VERIFY_SPAN = 0.5
+_CLICK_WINDOW = 0.01
+# how much louder (dB) the output's error at a boundary may be than in the audio around it
+_CLICK_THRESHOLD_DB = 6.0
+# error level below which the output counts as identical, so near-silence can't trip the check
+_ERROR_FLOOR = 1e-4
+# error (dB relative to the input) the audio after a join may have regardless of the audio before
+# it; audio that's out of step with the input has an error about as loud as the input itself
+_MISALIGNED_ERROR_DB = -20.0
+
+
+@dataclass
+class Segment:
+    index: int
+    # where this segment's audio goes in the output, in seconds
+    start: float
+    end: float
+    # what's actually encoded, including the overlap either side
+    encode_start: float
+    encode_end: float
+    path: Path
+    # which of the segment's encoded frames go in the output; None for all the rest
+    first_frame: int
+    end_frame: int | None
+
+
+def plan_segments(
+    duration: float,
+    sample_rate: int,
+    segment_duration: float,
+    work_dir: Path,
+) -> list[Segment]:
+    frame_duration = AAC_FRAME_SAMPLES / sample_rate
+    frames_per_segment = max(1, round(segment_duration / frame_duration))
+    total_frames = math.ceil(duration / frame_duration)
+    segments = []
+    for index, start_frame in enumerate(range(0, total_frames, frames_per_segment)):
+        end_frame = min(start_frame + frames_per_segment, total_frames)
+        encode_start_frame = max(start_frame - BOUNDARY_OVERLAP_FRAMES, 0)
+        is_last = end_frame == total_frames
+        segments.append(
+            Segment(
+                index=index,
+                start=start_frame * frame_duration,
+                end=min(end_frame * frame_duration, duration),
+                encode_start=encode_start_frame * frame_duration,
+                encode_end=min(
+                    (end_frame + BOUNDARY_OVERLAP_FRAMES) * frame_duration, duration
+                ),
+                path=work_dir / f"{index:05}.aac",
+                # a segment's encode is as far behind its input as a whole-file encode is, so
+                # output frame i is its frame i - encode_start_frame; this keeps the first
+                # segment's priming frame, and the last segment's final frames, which end the audio
+                first_frame=start_frame - encode_start_frame,
+                end_frame=None if is_last else end_frame - encode_start_frame,
+            )
+        )
+    return segments
+
+
+def should_segment(
+    probe: ProbeResult,
+    output_kwargs: dict[str, str],
+    segment_duration: float,
+) -> bool:
+    # stream copies are already fast, and one segment would just add overhead
+    return (
+        output_kwargs["acodec"] != "copy"
+        and probe.sample_rate is not None
+        and probe.duration >= 2 * segment_duration
+    )
+
+
+def encode_segment(
+    input_file_path: Path,
+    segment: Segment,
+    output_kwargs: dict[str, str],
+    slots: threading.Semaphore | None = None,
+):
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    # -ss/-t as input options: decoding starts at the (sample-accurate) seek point; the last segment
+    # runs to the end of the input, whatever its probed duration
+    input_kwargs = {"ss": f"{segment.encode_start:.6f}"}
+    if segment.end_frame is not None:
+        input_kwargs["t"] = f"{segment.encode_end - segment.encode_start:.6f}"
+    # raw ADTS, so the frames can be cut out without a demuxer applying its own edit list
+    cmd = ffmpeg.input(input_file_path, **input_kwargs).output(
+        str(segment.path), map="0:a", f="adts", **output_kwargs
+    )
+    try:
+        with nullcontext() if slots is None else slots:
+            cmd.run(quiet=True)
+    except ffmpeg.Error as exc:
+        print("    " + " ".join(str(c) for c in cmd.compile()))
+        print(exc.stderr.decode(errors="replace"))
+        raise
+
+
+def read_adts_frames(path: Path) -> list[bytes]:
+    """
+    splits a raw ADTS stream into its frames (header included)
+    """
+    data = path.read_bytes()
+    frames = []
+    offset = 0
+    while offset < len(data):
+        header = data[offset : offset + 7]
+        if len(header) < 7 or header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+            raise SegmentMismatch(f"No ADTS frame at byte {offset} of '{path}'")
+        frame_length = (header[3] & 0x03) << 11 | header[4] << 3 | header[5] >> 5
+        if frame_length < 7:
+            raise SegmentMismatch(f"Bad ADTS frame at byte {offset} of '{path}'")
+        frames.append(data[offset : offset + frame_length])
+        offset += frame_length
+    return frames
+
+
+def join_segments(
+    segments: list[Segment], output_file_path: Path, work_dir: Path, sample_rate: int
+):
+    """
+    joins encoded segments into one file without re-encoding, keeping each one's own frames
+    """
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    # as many frames as a single encode: one per (part) frame of input, plus the priming frame
+    expected_frames = (
+        math.ceil(segments[-1].end / (AAC_FRAME_SAMPLES / sample_rate))
+        + ENCODER_DELAY_FRAMES
+    )
+    joined_frames = 0
+    joined_path = work_dir / "joined.aac"
+    with open(joined_path, "wb") as joined:
+        for segment in segments:
+            frames = read_adts_frames(segment.path)[
+                segment.first_frame : segment.end_frame
+            ]
+            joined.writelines(frames)
+            joined_frames += len(frames)
+    if joined_frames != expected_frames:
+        raise SegmentMismatch(
+            f"Joined {joined_frames} AAC frame(s), expected {expected_frames}"
+        )
+
+    # starting the stream a priming frame early makes the MP4 muxer write an edit list that skips
+    # it, as it does for a single encode
+    cmd = ffmpeg.input(
+        str(joined_path),
+        itsoffset=f"-{ENCODER_DELAY_FRAMES * AAC_FRAME_SAMPLES / sample_rate:.9f}",
+    ).output(str(output_file_path), map="0:a", acodec="copy")
+    try:
+        cmd.run(quiet=True)
+    except ffmpeg.Error as exc:
+        print("    " + " ".join(str(c) for c in cmd.compile()))
+        print(exc.stderr.decode(errors="replace"))
+        raise
+
+
+def decode_pcm(path: Path, start: float, duration: float, sample_rate: int) -> array:
+    """
+    decodes part of a file to mono float samples
+    """
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    stdout, _ = (
+        ffmpeg.input(path, ss=f"{max(start, 0):.6f}", t=f"{duration:.6f}")
+        .output("-", f="f32le", ac=1, ar=sample_rate)
+        .run(quiet=True)
+    )
+    samples = array("f")
+    samples.frombytes(stdout[: len(stdout) // samples.itemsize * samples.itemsize])
+    return samples
+
+
+def _rms(samples) -> float:
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+def verify_segmented_output(
+    input_file_path: Path,
+    output_file_path: Path,
+    probe: ProbeResult,
+    segments: list[Segment],
+):
+    """
+    checks the joined output is as long as the input, has no clicks at the joins (around each join,
+    the output's error vs the input must be no worse than in the audio either side of it), and
+    stays in step with the input after each join
+    """
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    sample_rate = probe.sample_rate
+    output_duration = float(ffmpeg.probe(str(output_file_path))["format"]["duration"])
+    tolerance = 2 * AAC_FRAME_SAMPLES / sample_rate
+    if abs(output_duration - probe.duration) > tolerance:
+        raise SegmentMismatch(
+            f"Duration is {output_duration:.3f}s, expected {probe.duration:.3f}s"
+        )
+
+    window = round(_CLICK_WINDOW * sample_rate)
+    for segment in segments[1:]:
+        span_start = segment.start - _VERIFY_SPAN
+        expected = decode_pcm(
+            input_file_path, span_start, 2 * _VERIFY_SPAN, sample_rate
+        )
+        actual = decode_pcm(output_file_path, span_start, 2 * _VERIFY_SPAN, sample_rate)
+        error = [a - e for a, e in zip(actual, expected)]
+        boundary = round(min(_VERIFY_SPAN, segment.start) * sample_rate)
+        at_boundary = _rms(error[boundary - window : boundary + window])
+        around = _rms(error[: boundary - window] + error[boundary + window :])
+        limit = max(around, _ERROR_FLOOR) * 10 ** (_CLICK_THRESHOLD_DB / 20)
+        if at_boundary > limit:
+            raise SegmentMismatch(
+                f"Discontinuity at {segment.start:.3f}s: "
+                f"error {at_boundary:.5f} vs {around:.5f} around it"
+            )
+        # the next segment's encoder may settle a little differently from the last one's, but not
+        # by anywhere near the level of the audio itself
+        before = _rms(error[: boundary - window])
+        after = _rms(error[boundary + window :])
+        limit = max(
+            before * 10 ** (_CLICK_THRESHOLD_DB / 20),
+            _rms(expected) * 10 ** (_MISALIGNED_ERROR_DB / 20),
+            _ERROR_FLOOR,
+        )
+        if after > limit:
+            raise SegmentMismatch(
+                f"Output is out of step with the input after {segment.start:.3f}s: "
+                f"error {after:.5f} vs {before:.5f} before it"
+            )
+
+
+def encode_segmented(
+    input_file_path: Path,
+    output_file_path: Path,
+    probe: ProbeResult,
+    output_kwargs: dict[str, str],
+    segment_duration: float = DEFAULT_SEGMENT_DURATION,
+    slots: threading.Semaphore | None = None,
+):
+    """
+    encodes time segments of the input in parallel and joins them; raises SegmentMismatch if the
+    result doesn't pass verification, in which case the output is removed. each segment's ffmpeg
+    holds one of `slots` (if given) while it runs, so concurrent files share one limit
+    """
+    with tempfile.TemporaryDirectory(
+        prefix=".mtools-segments-", dir=output_file_path.parent
+    ) as work_dir:
+        segments = plan_segments(
+            probe.duration, probe.sample_rate, segment_duration, Path(work_dir)
+        )
+        LOGGER.info(
+            f"Encoding '{input_file_path}' as {len(segments)} segment(s) "
+            f"of up to {segment_duration}s"
+        )
+        with ThreadPoolExecutor() as executor:
+            # list() so the first failure is raised here
+            list(
+                executor.map(
+                    partial(
+                        encode_segment,
+                        input_file_path,
+                        output_kwargs=output_kwargs,
+                        slots=slots,
+                    ),
+                    segments,
+                )
+            )
+        join_segments(segments, output_file_path, Path(work_dir), probe.sample_rate)
+    try:
+        verify_segmented_output(input_file_path, output_file_path, probe, segments)
+    except BaseException:
+        output_file_path.unlink(missing_ok=True)
+        raise
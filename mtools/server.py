@@ -0,0 +1,190 @@
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import socketserver
+import traceback
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from multiprocessing.managers import SyncManager
+from pathlib import Path
+from queue import Empty
+
+from utils_python import setup_logger
+
+from mtools.client import SOCKET_ENV_VAR, get_default_socket_path
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds between checks that a command's worker is still alive while waiting for its output
+_OUTPUT_POLL_INTERVAL = 0.1
+
+
+class ProgramArgsNamespace(Namespace):
+    socket_path: Path
+    jobs: int
+
+
+def get_args(argv: list[str] | None = None) -> ProgramArgsNamespace:
+    parser = ArgumentParser(
+        description="serve mtools commands over a Unix socket from a warm worker pool"
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        dest="socket_path",
+        type=Path,
+        default=os.environ.get(SOCKET_ENV_VAR) or get_default_socket_path(),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="maximum number of commands to run at once, shared by all clients",
+    )
+    return parser.parse_args(argv, namespace=ProgramArgsNamespace())
+
+
+def _init_worker():
+    # pylint: disable=import-outside-toplevel
+    from mtools.cli import COMMANDS
+    from mtools.tag_mapper import get_tag_mapper
+
+    setup_logger()
+    for command, module_name in COMMANDS.items():
+        if command != "serve":
+            importlib.import_module(module_name)
+    get_tag_mapper()
+
+
+class _QueueWriter(io.TextIOBase):
+    """
+    text stream that puts each complete line on a queue, for the server to forward to the client
+    as it comes
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._buffer = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self._buffer += s
+        lines, newline, self._buffer = self._buffer.rpartition("\n")
+        if newline:
+            self.queue.put(lines + newline)
+        return len(s)
+
+    def flush(self):
+        if self._buffer:
+            self.queue.put(self._buffer)
+            self._buffer = ""
+
+
+def _run_command(command: str, argv: list[str], cwd: str, output_queue) -> int:
+    from mtools.cli import COMMANDS  # pylint: disable=import-outside-toplevel
+
+    os.chdir(cwd)
+    output = _QueueWriter(output_queue)
+    log_handler = logging.StreamHandler(output)
+    logging.getLogger().addHandler(log_handler)
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                module = importlib.import_module(COMMANDS[command])
+                module.main(module.get_args(argv))
+                exit_code = 0
+            except SystemExit as exc:
+                exit_code = exc.code if isinstance(exc.code, int) else 1
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+                exit_code = 1
+    finally:
+        logging.getLogger().removeHandler(log_handler)
+        output.flush()
+    return exit_code
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: "CommandServer"
+
+    def _send(self, response: dict):
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        command = request["command"]
+        if command == "serve":
+            self._send({"output": "cannot forward 'serve'\n", "exit_code": 2})
+            return
+        LOGGER.info(f"{command} {request['argv']} (cwd={request['cwd']!r})")
+        output_queue = self.server.manager.Queue()
+        future = self.server.executor.submit(
+            _run_command, command, request["argv"], request["cwd"], output_queue
+        )
+        while not future.done():
+            try:
+                self._send({"output": output_queue.get(timeout=_OUTPUT_POLL_INTERVAL)})
+            except Empty:
+                continue
+        # puts through the manager are synchronous, so once the command is done (or its worker has
+        # died) the rest of what it wrote is on the queue
+        while True:
+            try:
+                self._send({"output": output_queue.get_nowait()})
+            except Empty:
+                break
+        try:
+            exit_code = future.result()
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # e.g. BrokenProcessPool, if the worker was killed
+            LOGGER.exception(f"{command} {request['argv']} failed")
+            self._send(
+                {"output": f"mtools serve: {command} failed: {exc!r}\n", "exit_code": 1}
+            )
+            return
+        self._send({"exit_code": exit_code})
+
+
+class CommandServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self, socket_path: Path, executor: ProcessPoolExecutor, manager: SyncManager
+    ):
+        self.executor = executor
+        # owns the queues that stream each command's output back from its worker
+        self.manager = manager
+        super().__init__(str(socket_path), RequestHandler)
+
+
+def main(args: ProgramArgsNamespace) -> None:
+    if args.socket_path.exists():
+        args.socket_path.unlink()
+    with (
+        multiprocessing.Manager() as manager,
+        ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_init_worker
+        ) as executor,
+        CommandServer(args.socket_path, executor, manager) as server,
+    ):
+        LOGGER.info(f"Serving on {args.socket_path} with {args.jobs} worker(s)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            args.socket_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    setup_logger()
+    main(args)
@@ -0,0 +1,71 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from mtools.metrics import BYTES_WRITTEN
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class StagedFile:
+    path: Path
+    final_path: Path
+    size: int
+
+
+class ScratchSpace:
+    """
+    a local scratch directory with a byte budget; staging a file blocks until enough budget is free
+    """
+
+    def __init__(self, directory: Path, budget: int | None = None):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if budget is None:
+            budget = int(shutil.disk_usage(directory).free * 0.9)
+        self.budget = budget
+        self._available = budget
+        self._condition = threading.Condition()
+
+    def stage(self, final_path: Path, estimated_size: int) -> StagedFile:
+        # a file bigger than the whole budget can still be staged, once nothing else is
+        size = min(estimated_size, self.budget)
+        with self._condition:
+            self._condition.wait_for(lambda: self._available >= size)
+            self._available -= size
+        staged_dir = Path(tempfile.mkdtemp(prefix="mtools-", dir=self.directory))
+        return StagedFile(staged_dir / final_path.name, final_path, size)
+
+    def _release(self, staged: StagedFile):
+        shutil.rmtree(staged.path.parent, ignore_errors=True)
+        with self._condition:
+            self._available += staged.size
+            self._condition.notify_all()
+
+    def commit(self, staged: StagedFile):
+        """
+        moves a staged file to its destination: one sequential copy next to it, then an atomic
+        rename
+        """
+        try:
+            partial_path = staged.final_path.with_name(
+                f".{staged.final_path.name}.part"
+            )
+            try:
+                shutil.copy2(staged.path, partial_path)
+                os.replace(partial_path, staged.final_path)
+            except BaseException:
+                partial_path.unlink(missing_ok=True)
+                raise
+            BYTES_WRITTEN.inc(staged.final_path.stat().st_size)
+            LOGGER.info(f"Moved '{staged.path}' -> '{staged.final_path}'")
+        finally:
+            self._release(staged)
+
+    def discard(self, staged: StagedFile):
+        self._release(staged)
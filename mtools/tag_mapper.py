@@ -1,21 +1,21 @@
-import importlib
+import hashlib
 import re
+import threading
 from enum import StrEnum
+from functools import cache
 from pathlib import Path
 from typing import Any
 
-import requests
-from bs4 import BeautifulSoup
 from mutagen._file import FileType
-from mutagen.id3._frames import TextFrame
+from mutagen.id3 import Frames
+from mutagen.id3._frames import APIC, COMM, TXXX, Frame, TextFrame
 from mutagen.id3._specs import Encoding, PictureType
 from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
 from utils_python import PathInput, dump_data, read_dict_from_file
 
 from mtools.errors import UnrecognisedFormat, UnrecognisedTag, UnrecognisedValue
-
-_ID3_FRAMES_MODULE = importlib.import_module("mutagen.id3._frames")
+from mtools.metrics import CACHE_LOOKUPS
 
 
 class TagFormat(StrEnum):
@@ -51,11 +51,15 @@ class TagMapper:
     def __init__(
         self,
         mappings_save_path: PathInput | None = None,
+        mappings_by_label: dict | None = None,
     ):
+        """
+        mappings_by_label, if given, is used instead of the saved/downloaded mappings
+        """
         self._mappings_save_path = (
             Path(mappings_save_path) if mappings_save_path else None
         )
-        self._init_mappings()
+        self._init_mappings(mappings_by_label)
 
     @staticmethod
     def get_misc_field_tag(
@@ -188,20 +192,17 @@ class TagMapper:
                         result.append(v)
                 value_text = result
 
-            if hasattr(_ID3_FRAMES_MODULE, target_key):
-                cls = getattr(_ID3_FRAMES_MODULE, target_key)
+            if target_key in Frames:
+                cls = Frames[target_key]
                 if issubclass(cls, TextFrame):
                     return cls(text=value_text)
             elif target_key.startswith("COMM:"):
-                cls = getattr(_ID3_FRAMES_MODULE, "COMM")
-                return cls(text=value_text, lang="eng")
+                return COMM(text=value_text, lang="eng")
             elif target_key.startswith("TXXX:"):
-                cls = getattr(_ID3_FRAMES_MODULE, "TXXX")
                 fieldname = self.get_mp3_fieldname(target_key)
-                return cls(text=value_text, desc=fieldname)
+                return TXXX(text=value_text, desc=fieldname)
             elif label == "COVER":
-                cls = getattr(_ID3_FRAMES_MODULE, "APIC")
-                return cls(
+                return APIC(
                     encoding=Encoding.LATIN1,
                     mime=value_mime,
                     type=PictureType.COVER_FRONT,
@@ -266,6 +267,10 @@ class TagMapper:
 
     @staticmethod
     def _retrieve_mappings():
+        # only needed when no saved mappings exist; imported here to keep startup fast
+        import requests  # pylint: disable=import-outside-toplevel
+        from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
         url = "https://docs.mp3tag.de/mapping-table/"
         res = requests.get(url, timeout=10)
         res.encoding = "utf-8"
@@ -295,12 +300,15 @@ class TagMapper:
 
         return mappings
 
-    def _init_mappings(self):
-        if self._mappings_save_path:
-            self.mappings_by_label = read_dict_from_file(self._mappings_save_path)
+    def _init_mappings(self, mappings_by_label: dict | None = None):
+        if mappings_by_label is not None:
+            self.mappings_by_label = mappings_by_label
+        else:
+            if self._mappings_save_path:
+                self.mappings_by_label = read_dict_from_file(self._mappings_save_path)
 
-        if not self.mappings_by_label:
-            self.mappings_by_label = self._retrieve_mappings()
+            if not self.mappings_by_label:
+                self.mappings_by_label = self._retrieve_mappings()
 
         self.mappings_by_label = {
             k: v for k, v in self.mappings_by_label.items() if k != "Other fields"
@@ -311,7 +319,7 @@ class TagMapper:
             "MP4": "covr",
         }
         self.mappings_by_label["DESCRIPTION"] = {
-            **self.mappings_by_label["DESCRIPTION"],
+            **self.mappings_by_label.get("DESCRIPTION", {}),
             "ID3v2.3": "TXXX:DESCRIPTION",
             "ID3v2.4": "TXXX:DESCRIPTION",
         }
@@ -334,6 +342,7 @@ class TagMapper:
                 #     tag_name = [t.strip() for t in tag_name.split("|")]
                 label_mappings[format_] = tag_name
 
+        self.mappings_by_format = {}
         for label, label_mappings in self.mappings_by_label.items():
             for format_, tag_name in label_mappings.items():
                 format_mappings = self.mappings_by_format.setdefault(format_, {})
@@ -342,3 +351,122 @@ class TagMapper:
 
         if self._mappings_save_path:
             dump_data(self.mappings_by_label, self._mappings_save_path)
+
+
+def fingerprint_value(value: Any):
+    """
+    gets a hashable stand-in for a tag value; binary data (e.g. covers) is reduced to a digest
+    """
+    match value:
+        case bytes():
+            # also covers MP4Cover and MP4FreeForm
+            return (
+                value.__class__.__name__,
+                getattr(value, "imageformat", None),
+                getattr(value, "dataformat", None),
+                hashlib.blake2b(value, digest_size=16).digest(),
+            )
+        case list() | tuple():
+            return (value.__class__.__name__, *(fingerprint_value(v) for v in value))
+        case APIC():
+            return (
+                "APIC",
+                value.mime,
+                value.type,
+                value.desc,
+                fingerprint_value(value.data),
+            )
+        case Frame():
+            return (value.__class__.__name__, repr(value))
+        case _:
+            return (value.__class__.__name__, value)
+
+
+class TranslationCache:
+    """
+    memoizes TagMapper.translate_tag by value fingerprint, e.g. for tags shared by an album's
+    tracks; translated values are shared between files, so they must not be modified in place. may
+    be used
+    from several threads
+    """
+
+    def __init__(self, tag_mapper: TagMapper):
+        self._tag_mapper = tag_mapper
+        self._translations: dict[tuple, tuple | UnrecognisedTag] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def translate_tag(
+        self,
+        source_key,
+        source_value,
+        source_format,
+        target_format,
+    ):
+        cache_key = (
+            source_key,
+            fingerprint_value(source_value),
+            source_format,
+            target_format,
+        )
+        with self._lock:
+            translation = self._translations.get(cache_key)
+        if translation is None:
+            result = "miss"
+            # not under the lock, so other tags aren't held up; two threads may both translate a
+            # value, which is harmless
+            try:
+                translation = self._tag_mapper.translate_tag(
+                    source_key, source_value, source_format, target_format
+                )
+            except UnrecognisedTag as exc:
+                translation = exc
+            with self._lock:
+                self._translations[cache_key] = translation
+                self.misses += 1
+        else:
+            result = "hit"
+            with self._lock:
+                self.hits += 1
+        if isinstance(translation, UnrecognisedTag):
+            CACHE_LOOKUPS.inc(cache="translation", result=result)
+            raise translation
+        # covers are counted separately, as they're the expensive values to translate
+        _, _, label = translation
+        CACHE_LOOKUPS.inc(
+            cache="cover" if label == "COVER" else "translation", result=result
+        )
+        return translation
+
+
+def get_label_text(file: FileType, label: str) -> str | None:
+    """
+    gets the first value of the tag with the given label (e.g. "TITLE") as text, if the file has it
+    """
+    try:
+        key = get_tag_mapper().mappings_by_label[label][get_tag_format(file)]
+    except KeyError:
+        return None
+    if key not in file:
+        return None
+    return str(file[key][0])
+
+
+def get_album_key(file: FileType) -> tuple[str, str] | None:
+    """
+    gets (album artist, album) for a file, falling back to the track artist; None if there is no
+    album
+    """
+    if (album := get_label_text(file, "ALBUM")) is None:
+        return None
+    album_artist = get_label_text(file, "ALBUMARTIST") or get_label_text(file, "ARTIST")
+    return (album_artist or "", album)
+
+
+@cache
+def get_tag_mapper(mappings_save_path: PathInput | None = None) -> TagMapper:
+    """
+    gets a TagMapper whose mappings are built once per process and then reused
+    """
+    return TagMapper(mappings_save_path)
@@ -1,3 +1,5 @@
+import os
+import re
 from pathlib import Path
 
 from mutagen._file import FileType
@@ -9,8 +11,25 @@ from utils_python import PathInput
 def arg_to_enum(enum_class, arg):
     return enum_class(arg.upper())
 
+
 class UnsupportedFormat(Exception): ...
 
+
+AUDIO_SUFFIXES = {".mp3", ".m4a"}
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """
+    parses a byte count with an optional binary suffix, e.g. "512M" or "2G"
+    """
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Invalid size {size!r}")
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).upper()])
+
+
 def make_mutagen_file(path: PathInput) -> FileType:
     path = Path(path)
     suffixes_filetypes = {
@@ -24,32 +43,13 @@ def make_mutagen_file(path: PathInput) -> FileType:
     return filetype(path)
 
 
-def get_prefix_file_paths(
-    file_path: PathInput,
-    stem_only=True,
-) -> list[Path]:
-    """
-    gets all paths in same directory as given path whose names/stems are a shorter version of the given path
-    """
-    file_path = Path(file_path)
-    prefix_file_paths: list[Path] = []
-    for path in file_path.parent.iterdir():
-        if path == file_path:
-            continue
-        if stem_only:
-            if path.stem == file_path.stem:
-                continue
-            should_append = file_path.stem.startswith(path.stem)
-        else:
-            should_append = file_path.name.startswith(path.name)
-        if should_append:
-            prefix_file_paths.append(path)
-
-    return prefix_file_paths
-
-
 def ensure_file(file_path: Path) -> None:
     if file_path.is_dir():
         raise IsADirectoryError
     if not file_path.exists():
         raise FileNotFoundError(file_path)
+
+
+def get_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    return (Path(cache_home) if cache_home else Path.home() / ".cache") / "mtools"
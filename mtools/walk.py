@@ -0,0 +1,141 @@
+import os
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from mtools.utils import AUDIO_SUFFIXES, parse_size
+
+
+@dataclass
+class WalkFilter:
+    suffixes: set[str] | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+    modified_after: float | None = None
+    modified_before: float | None = None
+
+    @classmethod
+    def from_args(cls, args: Namespace, suffixes: set[str] | None = None):
+        return cls(
+            suffixes=suffixes,
+            min_size=args.min_size,
+            max_size=args.max_size,
+            modified_after=args.modified_after,
+            modified_before=args.modified_before,
+        )
+
+    @property
+    def needs_stat(self) -> bool:
+        return any(
+            bound is not None
+            for bound in (
+                self.min_size,
+                self.max_size,
+                self.modified_after,
+                self.modified_before,
+            )
+        )
+
+    def matches_name(self, name: str) -> bool:
+        return self.suffixes is None or os.path.splitext(name)[1] in self.suffixes
+
+    def matches_stat(self, stat: os.stat_result) -> bool:
+        return not (
+            (self.min_size is not None and stat.st_size < self.min_size)
+            or (self.max_size is not None and stat.st_size > self.max_size)
+            or (self.modified_after is not None and stat.st_mtime < self.modified_after)
+            or (
+                self.modified_before is not None
+                and stat.st_mtime >= self.modified_before
+            )
+        )
+
+
+def walk_files(
+    root: Path,
+    walk_filter: WalkFilter | None = None,
+    recursive: bool = True,
+) -> Iterator[Path]:
+    """
+    yields the files under root (or directly in it, if not recursive) that pass the filter, as
+    they're found; only one directory's listing is held at a time, and entries are only stat'd
+    when filtering by size/mtime
+    """
+    walk_filter = walk_filter or WalkFilter()
+    # directories still to list; popped from the end, so they're walked depth-first in name order
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as scanner:
+                entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            try:
+                # answered from the directory listing where the filesystem supports it
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirectories.append(Path(entry.path))
+                    continue
+                if not entry.is_file() or not walk_filter.matches_name(entry.name):
+                    continue
+                # DirEntry caches its stat, so this is at most one call per file
+                if walk_filter.needs_stat and not walk_filter.matches_stat(
+                    entry.stat()
+                ):
+                    continue
+            except OSError:
+                continue
+            yield Path(entry.path)
+        stack.extend(reversed(subdirectories))
+
+
+def iter_audio_files(
+    paths: list[Path],
+    walk_filter: WalkFilter | None = None,
+    recursive: bool = True,
+) -> Iterator[Path]:
+    """
+    yields the given files, and the supported audio files in the given directories (and their
+    subdirectories, if recursive) that pass the filter, as they're found
+    """
+    walk_filter = replace(
+        walk_filter or WalkFilter(),
+        suffixes=(walk_filter and walk_filter.suffixes) or AUDIO_SUFFIXES,
+    )
+    for path in paths:
+        if path.is_dir():
+            yield from walk_files(path, walk_filter, recursive=recursive)
+        else:
+            yield path
+
+
+def _parse_datetime(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def add_walk_args(parser: ArgumentParser):
+    parser.add_argument(
+        "--min-size",
+        type=parse_size,
+        help="only include files at least this big, e.g. '1M'",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=parse_size,
+        help="only include files at most this big",
+    )
+    parser.add_argument(
+        "--modified-after",
+        type=_parse_datetime,
+        help="only include files modified at/after this ISO date/time",
+    )
+    parser.add_argument(
+        "--modified-before",
+        type=_parse_datetime,
+        help="only include files modified before this ISO date/time",
+    )
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import pytest
+
+from mtools.convert_to_m4a import finish_stage
+from mtools.metrics import BYTES_WRITTEN
+from mtools.staging import ScratchSpace
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_output_bytes_are_counted_once(tmp_path: Path, staged: bool):
+    input_file_path = tmp_path / "input.flac"
+    input_file_path.write_bytes(b"input")
+    output_file_path = tmp_path / "input.m4a"
+    scratch = ScratchSpace(tmp_path / "scratch") if staged else None
+    if scratch is None:
+        encoded = (None, None)
+        output_file_path.write_bytes(b"output")
+    else:
+        staged_file = scratch.stage(output_file_path, estimated_size=6)
+        staged_file.path.write_bytes(b"output")
+        encoded = (staged_file, None)
+
+    before = BYTES_WRITTEN.get()
+    finish_stage(
+        input_file_path,
+        output_file_path,
+        input_file_path,
+        encoded,
+        run_metacopy=False,
+        keep_input=True,
+        scratch=scratch,
+    )
+    assert output_file_path.read_bytes() == b"output"
+    assert BYTES_WRITTEN.get() - before == len(b"output")
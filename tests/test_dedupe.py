@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from mutagen.apev2 import APEv2
+from mutagen.id3 import ID3, TIT2
+
+from mtools.dedupe import find_duplicates, group_candidates, hash_candidates
+
+# MPEG-1 layer III, 128kbps, 44.1kHz: 417 bytes per frame, header included
+MP3_FRAME_HEADER = b"\xff\xfb\x90\x64"
+MP3_FRAME_SIZE = 417
+
+
+def make_mp3(path: Path, title: str, fill: bytes = b"\x00", frames: int = 200) -> Path:
+    """
+    writes a CBR MP3 without a Xing header, so mutagen estimates its duration from its size
+    """
+    path.write_bytes(
+        (MP3_FRAME_HEADER + fill * (MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))) * frames
+    )
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=title))
+    tags.save(path)
+    return path
+
+
+def test_copies_differing_only_in_tags_are_duplicates(tmp_path: Path):
+    original = make_mp3(tmp_path / "original.mp3", "title")
+    retagged = make_mp3(tmp_path / "retagged.mp3", "a much longer title than before")
+    ID3(retagged).save(retagged, v1=2)
+    ape_tags = APEv2()
+    ape_tags["Comment"] = "tagged by another player"
+    ape_tags.save(retagged)
+    make_mp3(tmp_path / "other.mp3", "title", fill=b"\x01")
+
+    assert find_duplicates(sorted(tmp_path.iterdir()), max_workers=2) == [
+        [original, retagged]
+    ]
+
+
+def test_unreadable_files_are_skipped(tmp_path: Path):
+    first = make_mp3(tmp_path / "1.mp3", "title")
+    second = make_mp3(tmp_path / "2.mp3", "title")
+    third = make_mp3(tmp_path / "3.mp3", "title")
+    not_audio = tmp_path / "not_audio.mp3"
+    not_audio.write_bytes(b"not audio")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        groups = group_candidates(
+            executor, [first, second, third, not_audio], max_pending=4
+        )
+        assert [sorted(path for path, _ in group) for group in groups] == [
+            [first, second, third]
+        ]
+        # deleted between the scan and the hash
+        third.unlink()
+        assert hash_candidates(executor, groups) == [[first, second]]
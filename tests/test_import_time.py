@@ -0,0 +1,67 @@
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# the lightweight commands, and the CLI entry point that every command goes through
+LIGHT_MODULES = ["mtools.cli", "mtools.metadel", "mtools.metaview"]
+# only needed by some commands/options, so must be imported lazily
+DEFERRED_MODULES = {"requests", "bs4", "ffmpeg", "http.server"}
+# microseconds; generous, as this is to catch heavy imports creeping back in, not to benchmark
+IMPORT_TIME_BUDGET_US = 300_000
+
+
+def import_in_subprocess(modules: list[str]) -> tuple[set[str], str]:
+    """
+    imports the modules in a fresh interpreter; returns the loaded module names and -X importtime's
+    report
+    """
+    code = "; ".join(
+        [
+            *(f"import {module}" for module in modules),
+            "import sys",
+            "print(*sys.modules)",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split()), result.stderr
+
+
+def get_top_level_import_times(importtime_report: str) -> dict[str, int]:
+    """
+    parses `import time: self [us] | cumulative | imported package` lines, keeping top-level imports
+    """
+    times = {}
+    for line in importtime_report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if not cumulative.strip().isdigit():
+            # header line
+            continue
+        # nested imports are indented by two spaces per level
+        if name.startswith("  "):
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_deferred_modules_not_imported():
+    loaded, _ = import_in_subprocess(LIGHT_MODULES)
+    assert not DEFERRED_MODULES & loaded
+
+
+def test_import_time_within_budget():
+    _, report = import_in_subprocess(LIGHT_MODULES)
+    times = get_top_level_import_times(report)
+    total = sum(time for name, time in times.items() if name.split(".")[0] == "mtools")
+    assert total <= IMPORT_TIME_BUDGET_US, sorted(
+        times.items(), key=lambda item: item[1], reverse=True
+    )[:10]
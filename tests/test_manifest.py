@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+from mtools.manifest import (
+    CoverStore,
+    get_header_covers_dir,
+    is_header,
+    make_header,
+    value_from_json,
+    value_to_json,
+)
+from mtools.metaimport import get_covers_dir
+from mtools.tag_mapper import TagFormat, TagMapper
+
+
+def test_custom_field_round_trips_between_formats():
+    # custom (TXXX/freeform) fields are translated without the downloaded mappings
+    tag_mapper = TagMapper(mappings_by_label={})
+    json_value = ["some value"]
+
+    id3_value = value_from_json(
+        "TXXX:CUSTOMFIELD", json_value, TagFormat.ID3v2_4, cover_store=None
+    )
+    mp4_key, mp4_value, _ = tag_mapper.translate_tag(
+        "TXXX:CUSTOMFIELD", id3_value, TagFormat.ID3v2_4, TagFormat.MP4
+    )
+    assert mp4_key == "----:com.apple.iTunes:CUSTOMFIELD"
+    assert value_to_json(mp4_key, mp4_value, TagFormat.MP4) == json_value
+
+    id3_key, id3_value, _ = tag_mapper.translate_tag(
+        mp4_key,
+        value_from_json(mp4_key, json_value, TagFormat.MP4, cover_store=None),
+        TagFormat.MP4,
+        TagFormat.ID3v2_4,
+    )
+    assert id3_key == "TXXX:CUSTOMFIELD"
+    assert value_to_json(id3_key, id3_value, TagFormat.ID3v2_4) == json_value
+
+
+def test_cover_description_is_kept(tmp_path: Path):
+    cover_store = CoverStore(tmp_path)
+    json_value = {"cover": cover_store.put(b"image", "image/png"), "mime": "image/png"}
+
+    frame = value_from_json("APIC:back", json_value, TagFormat.ID3v2_4, cover_store)
+    assert frame.desc == "back"
+    assert frame.HashKey == "APIC:back"
+    assert frame.data == b"image"
+
+
+def test_covers_dir_is_read_from_the_header(tmp_path: Path, monkeypatch):
+    manifest_path = tmp_path / "exports" / "library.jsonl"
+    manifest_path.parent.mkdir()
+    covers_dir = tmp_path / "covers"
+
+    header = make_header(covers_dir, manifest_path)
+    assert is_header(header)
+    assert header["manifest"]["covers_dir"] == "../covers"
+    manifest_path.write_text(f'{json.dumps(header)}\n{{"path": "a.mp3"}}\n')
+    assert get_covers_dir(manifest_path).resolve() == covers_dir
+
+    # exported to stdout, from another directory
+    monkeypatch.chdir(tmp_path / "exports")
+    header = make_header(Path("covers"), None)
+    assert (
+        get_header_covers_dir(header, manifest_path) == tmp_path / "exports" / "covers"
+    )
+
+    # no header: next to the manifest if there, else ./covers
+    manifest_path.write_text('{"path": "a.mp3"}\n')
+    assert get_covers_dir(manifest_path) == Path("covers")
+    (tmp_path / "exports" / "library.covers").mkdir()
+    assert get_covers_dir(manifest_path) == tmp_path / "exports" / "library.covers"
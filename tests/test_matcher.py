@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from mtools.matcher import DEFAULT_MATCH_THRESHOLD, MatchFeatures, SourceIndex
+
+
+def features(name: str, duration: float, title: str = "", artist: str = ""):
+    return MatchFeatures(Path(name), duration, title, artist)
+
+
+def test_untagged_target_is_not_matched_on_duration_alone():
+    target = features("/music/02 Track.m4a", 200.0)
+    index = SourceIndex([features("/music/01 Track.mp3", 200.0)])
+
+    [match] = index.match(target)
+    assert match.score >= DEFAULT_MATCH_THRESHOLD
+    assert not match.identified
+    assert index.best_match(target) is None
+
+
+def test_untagged_target_is_matched_by_name_prefix():
+    source = features("/music/01 Track.mp3", 200.5)
+    index = SourceIndex([source, features("/music/02 Track.mp3", 200.0)])
+
+    match = index.best_match(features("/music/01 Track (converted).m4a", 200.0))
+    assert match is not None
+    assert match.source == source
+
+
+def test_tags_missing_on_the_source_are_left_out():
+    source = features("/music/a.mp3", 200.0, title="song")
+    index = SourceIndex([source, features("/music/b.mp3", 200.0)])
+
+    match = index.best_match(features("/music/c.m4a", 200.0, "song", "artist"))
+    assert match is not None
+    assert match.source == source
+    assert index.score(features("/music/c.m4a", 200.0, "other"), source) < (
+        DEFAULT_MATCH_THRESHOLD
+    )
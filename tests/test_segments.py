@@ -0,0 +1,99 @@
+import math
+import shutil
+from pathlib import Path
+
+import pytest
+
+from mtools.preflight import ProbeResult
+from mtools.segments import (
+    AAC_FRAME_SAMPLES,
+    BOUNDARY_OVERLAP_FRAMES,
+    ENCODER_DELAY_FRAMES,
+    decode_pcm,
+    encode_segmented,
+    plan_segments,
+)
+
+SAMPLE_RATE = 44100
+DURATION = 130.0
+SEGMENT_DURATION = 60.0
+
+requires_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="needs ffmpeg and ffprobe",
+)
+
+
+def test_plan_segments_take_every_output_frame_once():
+    frame_duration = AAC_FRAME_SAMPLES / SAMPLE_RATE
+    total_frames = math.ceil(DURATION / frame_duration)
+    segments = plan_segments(DURATION, SAMPLE_RATE, SEGMENT_DURATION, Path("work"))
+    assert len(segments) == 3
+
+    next_output_frame = 0
+    for segment in segments:
+        encode_start_frame = round(segment.encode_start / frame_duration)
+        assert encode_start_frame * frame_duration == pytest.approx(
+            segment.encode_start
+        )
+        if segment.index > 0:
+            assert segment.first_frame == BOUNDARY_OVERLAP_FRAMES
+        # a segment's frame i is output frame encode_start_frame + i
+        assert encode_start_frame + segment.first_frame == next_output_frame
+        if segment.end_frame is None:
+            next_output_frame = total_frames + ENCODER_DELAY_FRAMES
+        else:
+            next_output_frame = encode_start_frame + segment.end_frame
+            # the next segment still needs these frames' input to decode its first frame
+            assert segment.encode_end > segment.end
+    assert segments[-1].end == DURATION
+    assert next_output_frame == total_frames + ENCODER_DELAY_FRAMES
+
+
+def _rms(samples) -> float:
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+@requires_ffmpeg
+def test_segmented_encode_matches_input(tmp_path: Path):
+    import ffmpeg  # pylint: disable=import-outside-toplevel
+
+    input_file_path = tmp_path / "input.wav"
+    ffmpeg.input(
+        f"sine=frequency=440:sample_rate={SAMPLE_RATE}:duration={DURATION}", f="lavfi"
+    ).output(str(input_file_path), ac=2).run(quiet=True)
+    output_file_path = tmp_path / "output.m4a"
+    probe = ProbeResult(
+        path=str(input_file_path),
+        format_name="wav",
+        codec="pcm_s16le",
+        duration=DURATION,
+        channels=2,
+        sample_rate=SAMPLE_RATE,
+    )
+
+    # raises SegmentMismatch if it fails its own verification
+    encode_segmented(
+        input_file_path,
+        output_file_path,
+        probe,
+        {"acodec": "aac"},
+        segment_duration=SEGMENT_DURATION,
+    )
+
+    expected = decode_pcm(input_file_path, 0, DURATION + 1, SAMPLE_RATE)
+    actual = decode_pcm(output_file_path, 0, DURATION + 1, SAMPLE_RATE)
+    # like a single encode, padded to a whole frame at the end
+    assert 0 <= len(actual) - len(expected) < AAC_FRAME_SAMPLES
+
+    window = AAC_FRAME_SAMPLES * 4
+    for segment in plan_segments(DURATION, SAMPLE_RATE, SEGMENT_DURATION, tmp_path)[1:]:
+        seam = round(segment.start * SAMPLE_RATE)
+        error = [
+            a - e
+            for a, e in zip(
+                actual[seam - window : seam + window],
+                expected[seam - window : seam + window],
+            )
+        ]
+        assert _rms(error) < 0.05 * _rms(expected[seam - window : seam + window])
@@ -0,0 +1,62 @@
+import json
+import queue
+import socket
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from mtools.server import RequestHandler
+
+
+class LateCommand(queue.Queue):
+    """
+    a command's output queue, whose output arrives and whose command finishes just as the server's
+    wait for output times out
+    """
+
+    def __init__(self, output: list[str], result: int | BaseException):
+        super().__init__()
+        self.output = output
+        self.result = result
+        self.future = Future()
+
+    def submit(self, _func, _command, _argv, _cwd, output_queue) -> Future:
+        assert output_queue is self
+        return self.future
+
+    def get(self, block=True, timeout=None):
+        if block and not self.future.done():
+            for chunk in self.output:
+                self.put(chunk)
+            if isinstance(self.result, BaseException):
+                self.future.set_exception(self.result)
+            else:
+                self.future.set_result(self.result)
+            raise queue.Empty
+        return super().get(block, timeout)
+
+
+def handle_request(command: LateCommand) -> list[dict]:
+    server = SimpleNamespace(
+        executor=command, manager=SimpleNamespace(Queue=lambda: command)
+    )
+    client, connection = socket.socketpair()
+    with client, connection:
+        request = {"command": "view", "argv": [], "cwd": "."}
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        RequestHandler(connection, None, server)
+        connection.shutdown(socket.SHUT_WR)
+        with client.makefile("r", encoding="utf-8") as responses:
+            return [json.loads(line) for line in responses]
+
+
+def test_output_written_as_the_command_finishes_is_sent():
+    responses = handle_request(LateCommand(["a\n", "b\n"], 0))
+    assert responses == [{"output": "a\n"}, {"output": "b\n"}, {"exit_code": 0}]
+
+
+def test_dead_worker_still_sends_an_exit_code():
+    responses = handle_request(LateCommand(["a\n"], BrokenProcessPool("worker died")))
+    assert responses[0] == {"output": "a\n"}
+    assert "worker died" in responses[-1]["output"]
+    assert responses[-1]["exit_code"] == 1
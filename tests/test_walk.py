@@ -0,0 +1,15 @@
+from pathlib import Path
+
+from mtools.walk import iter_audio_files
+
+
+def test_iter_audio_files_only_recurses_if_asked(tmp_path: Path):
+    (tmp_path / "nested").mkdir()
+    for path in (tmp_path / "a.mp3", tmp_path / "nested" / "b.m4a", tmp_path / "c.txt"):
+        path.touch()
+
+    assert list(iter_audio_files([tmp_path], recursive=False)) == [tmp_path / "a.mp3"]
+    assert list(iter_audio_files([tmp_path])) == [
+        tmp_path / "a.mp3",
+        tmp_path / "nested" / "b.m4a",
+    ]